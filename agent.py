@@ -1,9 +1,28 @@
-from nn import MUT_AMMOUNT, MUT_RATE, NeuralNetwork
+from nn import MUT_AMMOUNT, NeuralNetwork
 from functools import total_ordering
+from collections import namedtuple
 import pickle
 
 STOP_TIME = 60
 
+# Motivos de término de um episódio
+END_STOPED   = 0  # parado, ou muito tempo sem progresso
+END_DEADLINE = 1  # alcançado pela dead line
+END_LEVEL    = 2  # morreu ou concluiu a fase
+END_RACE     = 3  # eliminado na corrida (avaliação parcial)
+
+# Resultado de um episódio, devolvido pelos workers no lugar do agente.
+# 'frames' é a duração do episódio e 'emulated' quantos desses frames
+# foram de fato emulados (o restante foi reaproveitado de outros episódios).
+# 'trace' são as decisões do episódio, se gravadas (ver traces.py), e
+# 'starts' os checkpoints (x, frame, savestate) capturados para a
+# biblioteca de inícios, com o savestate apenas na recaptura (ver starts.py)
+Result = namedtuple('Result', ['points', 'max_x', 'frames', 'reason', 'emulated', 'trace', 'starts'], defaults=(None, None))
+
+# Episódio pausado ao atingir o orçamento de frames: resultado parcial e
+# estado necessário para continuá-lo (ver train_level)
+Paused = namedtuple('Paused', ['result', 'state'])
+
 class Vec2:
     def __init__(self, x, y):
         self.x = x
@@ -15,8 +34,8 @@ class Vec2:
     
 @total_ordering
 class Agent:
-    def __init__(self, topology:list):
-        self.brain = NeuralNetwork(topology)
+    def __init__(self, topology:list, brain:NeuralNetwork=None):
+        self.brain = NeuralNetwork(topology) if brain is None else brain
 
         self.generation   = 1
         
@@ -30,6 +49,8 @@ class Agent:
         self.stoped       = False
 
         self.max_x        = 0
+        self.frames       = 0 # duração do último episódio completo (0: desconhecida)
+        self.start        = 0 # posição x do checkpoint de início do episódio (0: início do level)
 
     def mutate(self, prob, stdDev=MUT_AMMOUNT):
         """Aplica mutação ao agente
@@ -45,6 +66,19 @@ class Agent:
         if x > self.max_x:
             self.max_x = x
     
+    def progress(self):
+        """Estado do agente durante um episódio, para pausá-lo
+        """
+        return (self.curr_pos.x, self.curr_pos.y, self.prev_pos.x, self.prev_pos.y,
+                self.max_x, self.stoped_count, self.stoped)
+
+    def setProgress(self, progress):
+        """Restaura o estado obtido com progress()
+        """
+        cx, cy, px, py, self.max_x, self.stoped_count, self.stoped = progress
+        self.curr_pos.set(cx, cy)
+        self.prev_pos.set(px, py)
+    
     def is_stoped(self):
         """Verifica se o agente está parado, ou se passou muito tempo sem
         obter progresso
@@ -63,6 +97,15 @@ class Agent:
         
         return self.stoped
         
+    def setResult(self, result):
+        """Atualiza o agente com o resultado de um episódio
+        """
+        self.points = result.points
+        self.max_x  = result.max_x
+        self.frames = result.frames
+        self.trace  = result.trace
+        self.setScore()
+
     def setScore(self):
         """Calcula o score do agente
         """
@@ -97,14 +140,17 @@ class Agent:
         self.stoped       = False
 
 
-    def copy(self):
-        """Faz uma cópia do agente
+    def copy(self, brain=None):
+        """Faz uma cópia do agente. Se 'brain' for dado, ele é usado no
+        lugar de uma cópia da rede neural
         """
         nAgent = Agent([1,1])
-        nAgent.brain = self.brain.copy()
+        nAgent.brain = self.brain.copy() if brain is None else brain
         nAgent.points = self.points
         nAgent.score = self.score
         nAgent.fitness = self.fitness
+        nAgent.max_x = self.max_x
+        nAgent.frames = getattr(self, 'frames', 0)
         nAgent.generation = self.generation+1
         return nAgent
 
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import numpy as np
+from itertools import cycle
+from stub import StubEnv, Fixture, synthetic, record
+
+'''
+Benchmark dos pontos críticos do treinamento, sem ROM e sem o retro:
+a RAM vem de uma Fixture (gravada com --record em uma máquina com a ROM,
+ou sintética) reproduzida pelo StubEnv. Para cada função são exibidas as
+operações por segundo e os percentis de latência, que podem ser salvos
+em JSON (--save) e comparados com uma execução anterior (--compare).
+'''
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+parser.add_argument("-f", "--fixture"  , type=str  , metavar='', help="arquivo de RAMs gravadas (sintéticas se não existir)", default='benchmarks/YoshiIsland2.npz')
+parser.add_argument("-R", "--record"   , help="gravar a fixture jogando o level com o agente (requer retro e a ROM)", action="store_true")
+parser.add_argument("-a", "--agent"    , type=str  , metavar='', help="agente em 'agents/' usado em --record", default='current')
+parser.add_argument("-l", "--level"    , type=str  , metavar='', help="fase usada em --record", default='YoshiIsland2')
+parser.add_argument("-p", "--popsize"  , type=int  , metavar='', help="tamanho da população", default=50)
+parser.add_argument("-t", "--time"     , type=float, metavar='', help="segundos por benchmark", default=1.0)
+parser.add_argument("-s", "--save"     , type=str  , metavar='', help="salvar os resultados neste JSON", default=None)
+parser.add_argument("-c", "--compare"  , type=str  , metavar='', help="comparar com os resultados deste JSON", default=None)
+parser.add_argument("--tolerance"      , type=float, metavar='', help="aumento da mediana considerado regressão", default=0.2)
+parser.add_argument("-d", "--density"  , help="comparar o primeiro layer esparso e o denso por densidade do state", action="store_true")
+
+args = parser.parse_args()
+
+# train.py lê a linha de comando ao ser importado
+argv, sys.argv = sys.argv, sys.argv[:1]
+import train
+import pool
+import population
+from nn import NeuralNetwork
+from agent import Agent
+from population import Population, SharedPopulation
+from rominfo import getRam, getState, RamView
+sys.argv = argv
+
+# Duração (em frames) do episódio medido em train_level
+EPISODE_FRAMES = 2000
+
+
+def measure(fn, seconds):
+    """ Executa fn repetidamente por 'seconds' segundos (após uma execução
+    de aquecimento) e retorna as latências de cada chamada
+    """
+    fn()
+    latencies = []
+    end = time.perf_counter() + seconds
+    while True:
+        t = time.perf_counter()
+        fn()
+        now = time.perf_counter()
+        latencies.append(now - t)
+        if now > end and len(latencies) >= 5:
+            return np.array(latencies)
+
+
+def summary(latencies):
+    us = latencies * 1e6
+    return {'calls': len(us), 'ops': len(us) / latencies.sum(),
+            'p50': np.percentile(us, 50), 'p90': np.percentile(us, 90), 'p99': np.percentile(us, 99)}
+
+
+def benchmarks(fixture, popsize, workdir):
+    """ Gera os pares (nome, função) a serem medidos
+    """
+    radius = train.radius
+    env = StubEnv(fixture)
+    env.reset()
+    ram_view = RamView(env)
+
+    rams = cycle(fixture.frames)
+    states = cycle([getState(ram, radius)[0] for ram in fixture.frames[:64]])
+
+    agents = [Agent(train.topology) for i in range(popsize)]
+    for i, agent in enumerate(agents):
+        agent.points, agent.max_x = 10*i, 50*i
+        agent.setScore()
+    brain, other = agents[0].brain, agents[1].brain
+    frozen = brain.freeze()
+    pop = Population.fromAgents(agents)
+    parents = np.random.randint(popsize, size=popsize)
+    training_file = os.path.join(workdir, 'best.pkl')
+
+    # train_level roda no próprio processo, com o StubEnv como emulador
+    population.shared = SharedPopulation(train.topology, 1)
+    population.shared.load(agents[:1])
+    pool.env, pool.env_level = StubEnv(fixture), 'stub'
+
+    def repopulate():
+        with contextlib.redirect_stdout(None):
+            train.repopulate(list(agents), training_file)
+
+    yield 'getRam', lambda: getRam(env)
+    yield 'RamView.refresh', ram_view.refresh
+    yield 'getState', lambda: getState(next(rams), radius)
+    yield 'NeuralNetwork.predict', lambda: brain.predict([next(states)])
+    yield 'FrozenNetwork.predict', lambda: frozen.predict(next(states))
+    yield 'FrozenNetwork.act', lambda: frozen.act(next(states))
+    yield 'NeuralNetwork.freeze', brain.freeze
+    yield 'NeuralNetwork.mutation', lambda: brain.copy().mutation()
+    yield 'NeuralNetwork.crossover', lambda: NeuralNetwork.crossover(brain, other)
+    yield 'Population.mutation', lambda: pop.take(parents).mutation(stdDev=np.full(popsize, 0.1))
+    yield 'Population.crossover', lambda: pop.crossover(parents, parents[::-1])
+    yield 'repopulate', repopulate
+    yield 'train_level', lambda: train.train_level(0, False, 'stub', budget=EPISODE_FRAMES)
+
+
+def density(fixture, seconds):
+    """ Mede FrozenNetwork.act com o primeiro layer denso e com o esparso
+    para states sintéticos de densidades crescentes e imprime a maior
+    densidade em que o esparso é mais rápido (valor para train.py --sparse)
+    """
+    brain = NeuralNetwork(train.topology)
+    dense, sparse = brain.freeze(), brain.freeze(sparse=1.0)
+    size = train.input_size
+
+    real = np.mean([np.count_nonzero(getState(ram, train.radius)[0]) / size for ram in fixture.frames[:64]])
+    print()
+    print("Densidade média dos states da fixture: {:.1%}".format(real))
+    print("{:<10} {:>14} {:>16} {:>8}".format("densidade", "denso p50 (us)", "esparso p50 (us)", "razão"))
+
+    crossover = 0.0
+    for d in [0.0, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.6, 0.8, 1.0]:
+        states = np.zeros((64, size), dtype=np.int8)
+        k = int(round(d * size))
+        for s in states:
+            s[np.random.choice(size, k, replace=False)] = np.random.choice([-1, 1], k)
+        cycle_d, cycle_s = cycle(states), cycle(states)
+        p50_d = summary(measure(lambda: dense.act(next(cycle_d)), seconds))['p50']
+        p50_s = summary(measure(lambda: sparse.act(next(cycle_s)), seconds))['p50']
+        if p50_s < p50_d:
+            crossover = d
+        print("{:<10.0%} {:>14,.1f} {:>16,.1f} {:>8.2f}".format(d, p50_d, p50_s, p50_s / p50_d))
+
+    if crossover > 0:
+        print("Esparso mais rápido até {:.0%} de células não nulas".format(crossover))
+    else:
+        print("Esparso mais lento em todas as densidades: use o produto denso (--sparse 0)")
+
+
+def compare(results, baseline, tolerance):
+    """ Imprime a variação da mediana em relação ao baseline e retorna
+    os benchmarks que pioraram mais que 'tolerance'
+    """
+    regressions = []
+    print()
+    print("{:<26} {:>12} {:>12} {:>8}".format("comparação (p50, us)", "baseline", "atual", "razão"))
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        ratio = res['p50'] / baseline[name]['p50']
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  REGRESSÃO'
+        print("{:<26} {:>12,.1f} {:>12,.1f} {:>8.2f}{}".format(name, baseline[name]['p50'], res['p50'], ratio, flag))
+    return regressions
+
+
+def main():
+    if args.record:
+        agent = Agent.load("agents/"+args.agent+".pkl")
+        fixture = record(agent, args.level)
+        os.makedirs(os.path.dirname(args.fixture) or '.', exist_ok=True)
+        fixture.save(args.fixture)
+        print("Fixture com {} RAMs salva em '{}'".format(len(fixture.frames), args.fixture))
+        return
+
+    if os.path.isfile(args.fixture):
+        fixture, source = Fixture.load(args.fixture), args.fixture
+    else:
+        fixture, source = synthetic(), 'sintética'
+    print("Fixture: {} ({} RAMs)".format(source, len(fixture.frames)))
+
+    results = {}
+    print("{:<26} {:>8} {:>12} {:>12} {:>12} {:>12}".format("benchmark", "chamadas", "ops/s", "p50 (us)", "p90 (us)", "p99 (us)"))
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, fn in benchmarks(fixture, args.popsize, workdir):
+            res = summary(measure(fn, args.time))
+            results[name] = res
+            print("{:<26} {:>8} {:>12,.1f} {:>12,.1f} {:>12,.1f} {:>12,.1f}".format(
+                name, res['calls'], res['ops'], res['p50'], res['p90'], res['p99']))
+    population.shared.close(unlink=True)
+
+    if args.density:
+        density(fixture, args.time / 4)
+
+    if args.save is not None:
+        os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump({'fixture': source, 'popsize': args.popsize, 'results': results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import os
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from agent import Result
+
+'''
+Cache de avaliações.
+
+O emulador é determinístico para um mesmo savestate e uma mesma sequência
+de ações, então um genoma já avaliado no mesmo level e com as mesmas
+configurações de avaliação não precisa ser jogado de novo. A chave é um
+hash dos pesos e das configurações; o valor é o Result do episódio.
+'''
+
+class FitnessCache:
+    def __init__(self, capacity=10000, filename=None, file_capacity=100000):
+        """ 'capacity' limita o número de entradas em memória (LRU).
+        Se 'filename' for dado, as entradas mais recentes (até
+        'file_capacity') são carregadas dele e salvas nele por save()
+        """
+        self.capacity = capacity
+        self.filename = filename
+        self.file_capacity = file_capacity
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if filename is not None and os.path.isfile(filename):
+            self.loadFile()
+
+    @staticmethod
+    def key(genome, settings):
+        """ Hash do genoma (array de pesos) e das configurações de avaliação
+        """
+        h = hashlib.blake2b(settings.encode(), digest_size=16)
+        h.update(np.ascontiguousarray(genome).tobytes())
+        return h.digest()
+
+    def get(self, key, trace=False):
+        """ Retorna o Result guardado para 'key', ou None. Com 'trace',
+        resultados sem as decisões gravadas (os carregados do arquivo)
+        também retornam None, para que o episódio seja jogado de novo
+        """
+        result = self.entries.get(key)
+        if result is None or (trace and result.trace is None):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def report(self):
+        """ Retorna e zera o número de acertos e de consultas
+        """
+        hits, total = self.hits, self.hits + self.misses
+        self.hits = self.misses = 0
+        return hits, total
+
+    def loadFile(self):
+        with np.load(self.filename) as data:
+            for key, record in zip(data['keys'], data['results']):
+                self.put(key.tobytes(), Result(float(record[0]), int(record[1]),
+                                               int(record[2]), int(record[3]), int(record[4])))
+
+    def save(self):
+        """ Salva as entradas mais recentes em 'filename'
+        """
+        if self.filename is None:
+            return
+
+        items = list(self.entries.items())[-self.file_capacity:]
+        keys = np.array([k for k, r in items], dtype='S16').view(np.uint8).reshape(-1, 16)
+        # as decisões gravadas (trace) ficam apenas em memória
+        results = np.array([tuple(r[:5]) for k, r in items], dtype=np.float64).reshape(-1, 5)
+
+        # grava em um arquivo temporário para não corromper o anterior
+        tmp = self.filename + '.tmp.npz'
+        np.savez(tmp, keys=keys, results=results)
+        os.replace(tmp, self.filename)
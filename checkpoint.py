@@ -0,0 +1,150 @@
+import os
+import time
+import threading
+import numpy as np
+from collections import namedtuple
+from agent import Agent
+from population import Population
+
+'''
+Checkpoints da população inteira.
+
+Um checkpoint guarda os genomas de todos os agentes (um array agentes x
+pesos, como em population.py), alguns atributos de cada agente, o número
+da geração, o estado do gerador de números aleatórios do numpy e o
+best_ever. É salvo em um .npz sem compressão (e sem pickle), que é
+carregado rapidamente mesmo com populações grandes.
+
+A escrita é feita por uma thread (CheckpointWriter), para que a avaliação
+da geração seguinte não espere pelo disco.
+'''
+
+# Atributos de cada agente guardados no checkpoint
+STATS = ['generation', 'points', 'score', 'fitness', 'max_x', 'frames']
+
+Checkpoint = namedtuple('Checkpoint', ['generation', 'genomes', 'stats', 'rng', 'best', 'best_stats'])
+
+
+def agentStats(agent):
+    return [getattr(agent, name, 0) for name in STATS]
+
+
+def capture(agents, generation, best_ever):
+    """ Cria um Checkpoint com cópias dos dados dos agentes, que podem
+    continuar sendo modificados enquanto ele é salvo
+    """
+    genomes = Population.fromAgents(agents).genomes
+    stats = np.array([agentStats(a) for a in agents], dtype=np.float64)
+
+    best = best_stats = None
+    if best_ever is not None:
+        best = Population.fromAgents([best_ever]).genomes[0]
+        best_stats = np.array(agentStats(best_ever), dtype=np.float64)
+
+    return Checkpoint(generation, genomes, stats, np.random.get_state(), best, best_stats)
+
+
+def save(filename, checkpoint):
+    """ Salva o checkpoint em 'filename'
+    """
+    name, keys, pos, has_gauss, gauss = checkpoint.rng
+    data = dict(generation=checkpoint.generation, genomes=checkpoint.genomes, stats=checkpoint.stats,
+                rng_keys=keys, rng_pos=pos, rng_has_gauss=has_gauss, rng_gauss=gauss)
+    if checkpoint.best is not None:
+        data.update(best=checkpoint.best, best_stats=checkpoint.best_stats)
+
+    # grava em um arquivo temporário para não corromper o anterior
+    tmp = filename + '.tmp.npz'
+    np.savez(tmp, **data)
+    os.replace(tmp, filename)
+
+
+def load(filename):
+    """ Carrega o Checkpoint salvo em 'filename'
+    """
+    with np.load(filename) as data:
+        rng = ('MT19937', data['rng_keys'], int(data['rng_pos']),
+               int(data['rng_has_gauss']), float(data['rng_gauss']))
+        best = data['best'] if 'best' in data else None
+        best_stats = data['best_stats'] if 'best_stats' in data else None
+        return Checkpoint(int(data['generation']), data['genomes'], data['stats'], rng, best, best_stats)
+
+
+def toAgent(topology, brain, stats):
+    agent = Agent(topology, brain)
+    for name, value in zip(STATS, stats):
+        setattr(agent, name, int(value) if name in ('generation', 'max_x', 'frames') else float(value))
+    return agent
+
+
+def restore(checkpoint, topology):
+    """ Recria os agentes e o best_ever do checkpoint e restaura o estado
+    do gerador de números aleatórios. Retorna (agentes, best_ever)
+    """
+    population = Population(topology, checkpoint.genomes)
+    if population.bounds[-1] != population.genomes.shape[1]:
+        raise ValueError("checkpoint com genomas de {} pesos, a topologia {} tem {}".format(
+            population.genomes.shape[1], topology, population.bounds[-1]))
+
+    agents = [toAgent(topology, population.brain(i), stats) for i, stats in enumerate(checkpoint.stats)]
+
+    best_ever = None
+    if checkpoint.best is not None:
+        best = Population(topology, checkpoint.best[None])
+        best_ever = toAgent(topology, best.brain(0), checkpoint.best_stats)
+
+    np.random.set_state(checkpoint.rng)
+    return agents, best_ever
+
+
+class CheckpointWriter:
+    """ Salva checkpoints em 'filename' em uma thread. Se um checkpoint
+    chegar enquanto o anterior ainda está sendo salvo, apenas o mais
+    recente que estiver esperando é mantido
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.pending = None
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+
+        self.written = 0
+        self.seconds = 0.0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, checkpoint):
+        if self.error is not None:
+            raise self.error
+        with self.cond:
+            self.pending = checkpoint
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.closed:
+                    self.cond.wait()
+                if self.pending is None:
+                    return
+                checkpoint, self.pending = self.pending, None
+
+            try:
+                start = time.perf_counter()
+                save(self.filename, checkpoint)
+                self.seconds += time.perf_counter() - start
+                self.written += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """ Espera o último checkpoint ser salvo
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
@@ -0,0 +1,166 @@
+import numpy as np
+import multiprocessing as mp
+from queue import Empty
+from multiprocessing import shared_memory
+from population import SharedPopulation
+
+'''
+Servidor central de inferência.
+
+Cada processo de treinamento roda apenas um emulador, e a cada decisão
+faz um feedforward de um único state (1 x 169), o que é praticamente só
+overhead. Neste modo os workers escrevem o state em um slot de memória
+compartilhada e avisam o servidor pela fila 'requests'. O servidor junta
+todas as requisições pendentes e faz um único feedforward em lote, cada
+linha com os pesos do seu agente, devolvendo a ação no mesmo slot.
+Os pesos são lidos diretamente dos genomas compartilhados (SharedPopulation).
+'''
+
+# Cliente do processo atual, definido por initWorker
+client = None
+
+
+def initWorker(*client_args):
+    """ Initializer dos workers: conecta o processo ao servidor
+    """
+    global client
+    client = InferenceClient(*client_args)
+
+
+class InferenceClient:
+    def __init__(self, shm_name, slots, input_size, requests, ready, counter):
+        # Cada processo recebe um slot exclusivo
+        with counter.get_lock():
+            self.slot = counter.value
+            counter.value += 1
+
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self.states, self.agent_ids, self.actions = sharedArrays(self.shm, slots, input_size)
+        self.requests = requests
+        self.ready = ready[self.slot]
+
+    def predict(self, agent_id, state):
+        """ Envia o state do agente 'agent_id' ao servidor e aguarda
+        o índice da ação escolhida
+        """
+        self.states[self.slot] = state
+        self.agent_ids[self.slot] = agent_id
+        self.requests.put(self.slot)
+        self.ready.acquire()
+        return self.actions[self.slot]
+
+
+def sharedArrays(shm, slots, input_size):
+    """ Organiza o bloco de memória compartilhada em três arrays:
+    states (slots x input_size), agent_ids (slots) e actions (slots)
+    """
+    states_bytes = slots*input_size*8
+    states    = np.ndarray((slots, input_size), dtype=np.float64, buffer=shm.buf)
+    agent_ids = np.ndarray(slots, dtype=np.int64, buffer=shm.buf, offset=states_bytes)
+    actions   = np.ndarray(slots, dtype=np.int64, buffer=shm.buf, offset=states_bytes + slots*8)
+    return states, agent_ids, actions
+
+
+def stackedWeights(population):
+    """ Views (agentes x linhas x colunas) de cada layer da população
+    """
+    n = len(population)
+    return [population.genomes[:, lo:hi].reshape(n, rows, cols)
+            for (rows, cols), lo, hi in zip(population.layers, population.bounds, population.bounds[1:])]
+
+
+def forward(weights, ids, X):
+    """ FeedForward em lote: a linha i de X passa pelas matrizes peso do
+    agente ids[i]. 'weights' é uma lista, por layer, de arrays
+    (agentes x linhas x colunas), com o bias na primeira linha
+    """
+    curr = X
+    for w in weights:
+        w = w[ids]
+        prod = np.matmul(curr[:, None, :], w[:, 1:, :])[:, 0, :] + w[:, 0, :]
+        curr = 1 / (1 + np.exp(-prod))
+    return curr
+
+
+def serve(shm_name, slots, input_size, requests, ready, stats, genomes_spec):
+    """ Laço principal do servidor. Mensagens na fila 'requests':
+    int: slot com um state pendente
+    None: encerra o servidor
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    states, agent_ids, actions = sharedArrays(shm, slots, input_size)
+    genomes = SharedPopulation(*genomes_spec)
+    weights = stackedWeights(genomes)
+
+    try:
+        while True:
+            pending = [requests.get()]
+            # Junta tudo o que já está na fila para um único lote
+            try:
+                while True:
+                    pending.append(requests.get_nowait())
+            except Empty:
+                pass
+
+            if None in pending:
+                return
+            flush(weights, pending, states, agent_ids, actions, ready, stats)
+    finally:
+        del states, agent_ids, actions, weights
+        shm.close()
+        genomes.close()
+
+
+def flush(weights, batch, states, agent_ids, actions, ready, stats):
+    """ Executa o feedforward do lote e libera os workers que aguardam
+    """
+    if not batch:
+        return
+    batch = np.array(batch)
+    prediction = forward(weights, agent_ids[batch], states[batch])
+    actions[batch] = np.argmax(prediction, axis=1)
+    for slot in batch:
+        ready[slot].release()
+
+    with stats.get_lock():
+        stats[0] += len(batch)
+        stats[1] += 1
+
+
+class InferenceServer:
+    def __init__(self, input_size, slots, genomes):
+        self.input_size = input_size
+        self.slots = slots
+
+        size = slots*input_size*8 + 2*slots*8
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.requests = mp.Queue()
+        self.ready = [mp.Semaphore(0) for i in range(slots)]
+        self.counter = mp.Value('i', 0)
+        self.stats = mp.Array('q', 2)  # requisições, lotes
+
+        self.process = mp.Process(target=serve, daemon=True,
+                                  args=(self.shm.name, slots, input_size,
+                                        self.requests, self.ready, self.stats,
+                                        genomes.spec()))
+        self.process.start()
+
+    def clientArgs(self):
+        """ Argumentos de initWorker, usados pelos workers do pool
+        """
+        return (self.shm.name, self.slots, self.input_size,
+                self.requests, self.ready, self.counter)
+
+    def report(self):
+        """ Retorna e zera o número de requisições e de lotes processados
+        """
+        with self.stats.get_lock():
+            requests, batches = self.stats[:]
+            self.stats[0] = self.stats[1] = 0
+        return requests, batches
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join()
+        self.shm.close()
+        self.shm.unlink()
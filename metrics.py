@@ -0,0 +1,158 @@
+import os
+import csv
+import sys
+import time
+import argparse
+
+'''
+Log de métricas do treinamento, uma linha por geração.
+
+O train.py acrescenta uma linha ao CSV "agents/[agente]_metrics.csv" ao
+fim de cada geração, sem nunca reescrever as anteriores: o tempo da
+geração, os frames emulados e a vazão, o tempo ocioso dos workers, os
+quantis do score e as trocas do best_ever. A coluna 'run' identifica
+cada execução (o instante em que ela começou), para que execuções
+retomadas de um checkpoint continuem no mesmo arquivo.
+
+Este módulo não depende do código de treinamento, e pode ser executado
+para resumir ou acompanhar um log:
+
+    python metrics.py agents/current_metrics.csv
+    python metrics.py agents/current_metrics.csv --tail 20 --follow
+'''
+
+COLUMNS = ['run', 'generation', 'timestamp', 'seconds', 'episodes', 'frames', 'emulated',
+           'frames_per_s', 'episodes_per_s', 'busy', 'idle', 'utilization',
+           'score_min', 'score_q25', 'score_median', 'score_q75', 'score_max', 'score_mean',
+           'best_distance', 'best_ever', 'best_ever_changed']
+
+# Colunas exibidas por --tail
+TAIL = ['generation', 'seconds', 'frames_per_s', 'episodes_per_s', 'utilization',
+        'score_median', 'score_max', 'best_ever', 'best_ever_changed']
+
+
+class MetricsLog:
+    def __init__(self, filename):
+        """ Acrescenta linhas ao CSV 'filename', criando-o com o cabeçalho
+        se ele não existir
+        """
+        self.filename = filename
+        self.run = int(time.time())
+        new = not os.path.isfile(filename) or os.path.getsize(filename) == 0
+        self.file = open(filename, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new:
+            self.writer.writerow(COLUMNS)
+            self.file.flush()
+
+    def write(self, **values):
+        """ Acrescenta a linha de uma geração. Colunas ausentes ficam vazias
+        """
+        values.update(run=self.run, timestamp=round(time.time(), 3))
+        self.writer.writerow([fmt(values.get(c, '')) for c in COLUMNS])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def fmt(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        return round(value, 4)
+    return value
+
+
+def read(filename):
+    """ Linhas do log como dicionários, com os números convertidos
+    """
+    with open(filename, newline='') as f:
+        return [{k: number(v) for k, v in row.items()} for row in csv.DictReader(f)]
+
+
+def number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+def mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else float('nan')
+
+
+def summary(rows):
+    """ Resumo de cada execução do log
+    """
+    runs = {}
+    for row in rows:
+        runs.setdefault(row['run'], []).append(row)
+
+    lines = []
+    for run, rows in runs.items():
+        seconds = sum(r['seconds'] or 0 for r in rows)
+        emulated = sum(r['emulated'] or 0 for r in rows)
+        episodes = sum(r['episodes'] or 0 for r in rows)
+        first, last = rows[0], rows[-1]
+        lines.append("Execução {} ({}): gerações {}-{} em {:,.1f}s ({:.2f}s por geração)".format(
+            run, time.strftime('%Y-%m-%d %H:%M', time.localtime(run)),
+            first['generation'], last['generation'], seconds, seconds / len(rows)))
+        lines.append("  Vazão: {:,.0f} frames/s | {:,.1f} episódios/s | utilização média {:.1%}".format(
+            emulated / max(seconds, 1e-9), episodes / max(seconds, 1e-9), mean(r['utilization'] for r in rows)))
+        lines.append("  Score: mediana {:,.1f} -> {:,.1f} | máximo {:,.1f} -> {:,.1f}".format(
+            first['score_median'], last['score_median'], first['score_max'], last['score_max']))
+        lines.append("  Best ever: {:,.1f} | {} trocas".format(
+            last['best_ever'] or 0, sum(r['best_ever_changed'] or 0 for r in rows)))
+    return '\n'.join(lines)
+
+
+def table(rows, columns=TAIL):
+    """ Linhas do log em colunas alinhadas
+    """
+    width = [max(len(c), 12) for c in columns]
+    lines = [' '.join(c.rjust(w) for c, w in zip(columns, width))]
+    for row in rows:
+        cells = []
+        for c, w in zip(columns, width):
+            v = row.get(c)
+            cells.append(('' if v is None else '{:,.2f}'.format(v) if isinstance(v, float) else str(v)).rjust(w))
+        lines.append(' '.join(cells))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("log"             , type=str, help="log de métricas (ex.: agents/current_metrics.csv)")
+    parser.add_argument("-t", "--tail"    , type=int, metavar='', help="exibir as últimas N gerações em vez do resumo", default=0)
+    parser.add_argument("-f", "--follow"  , help="com --tail, continuar exibindo as novas gerações", action="store_true")
+    parser.add_argument("-i", "--interval", type=float, metavar='', help="segundos entre leituras com --follow", default=2.0)
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.log):
+        sys.exit("arquivo não encontrado: {}".format(args.log))
+
+    rows = read(args.log)
+    if args.tail <= 0:
+        print(summary(rows) if rows else "Log vazio")
+        return
+
+    print(table(rows[-args.tail:]))
+    seen = len(rows)
+    while args.follow:
+        time.sleep(args.interval)
+        rows = read(args.log)
+        if len(rows) > seen:
+            print('\n'.join(table(rows[seen:]).split('\n')[1:]))
+            seen = len(rows)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
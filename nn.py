@@ -1,5 +1,4 @@
 import numpy as np
-from itertools import product
 
 W_MIN = 0.01
 W_MAX = 2.00
@@ -20,6 +19,36 @@ def dsigmoid(z):
 	sigm = sigmoid(z)
 	return sigm * (1 - sigm)
 
+def mutationIndices(n, prob):
+	""" Índices (em range(n)) sorteados para mutação, cada um com
+	probabilidade 'prob'. Em vez de um sorteio por peso, são sorteados os
+	intervalos (geométricos) entre um índice mutado e o próximo.
+	"""
+	if prob <= 0:
+		return np.zeros(0, dtype=np.int64)
+	if prob >= 1:
+		return np.arange(n)
+
+	chunks = []
+	pos = -1
+	while True:
+		# amostragem da distribuição geométrica pela inversa da CDF
+		u = 1.0 - np.random.random(int(n*prob*1.1) + 16)
+		gaps = (np.log(u) / np.log1p(-prob)).astype(np.int64) + 1
+		steps = pos + np.cumsum(gaps)
+		chunks.append(steps[steps < n])
+		if steps[-1] >= n:
+			return np.concatenate(chunks)
+		pos = steps[-1]
+
+def clipWeights(w):
+	""" Ajusta os pesos que, após a mutação, excedem os limites
+	"""
+	absW = np.abs(w)
+	w = np.where(absW > W_MAX, W_MAX * np.sign(w), w)
+	w[absW < W_MIN] = 0.0
+	return w
+
 def tanh(z):
 	return np.tanh(z)
 
@@ -28,17 +57,22 @@ def dtanh(z):
 	return 1 - np.power(t,2)
 
 class NeuralNetwork:
-    def __init__(self, topology:list):
+    def __init__(self, topology:list, weights:list=None):
 
         # Numero de neuronios por layer
         self.shape = topology.copy()
 
+        # Função de ativação
+        self.actv = ActivationFunction(sigmoid, dsigmoid)
+
+        # Pesos já existentes (ex.: views de uma Population) são usados como estão
+        if weights is not None:
+            self.weights = weights
+            return
+
         # Pesos inicializados com zero
         num_weights = len(topology)-1
         self.weights = [np.zeros((topology[i]+1, topology[i+1])) for i in range(num_weights)]
-        
-        # Função de ativação
-        self.actv = ActivationFunction(sigmoid, dsigmoid)
 
         # Mutação inicial
         self.mutation(prob=0.5,stdDev=0.5)
@@ -56,7 +90,7 @@ class NeuralNetwork:
         """ FeedFoward do input através das matrizes peso
         """
         # curr -> layer atual
-        curr = np.array(input, dtype=np.float)
+        curr = np.array(input, dtype=np.float64)
         for w in self.weights:
             # É adcionado um nó extra, sempre igual a 1 (bias)
             curr_with_bias = np.hstack((np.ones((curr.shape[0], 1)), curr))
@@ -87,7 +121,7 @@ class NeuralNetwork:
         for idx, w in enumerate(child.weights):
             B_w = B.weights[idx]
             row, col = w.shape
-            partition = np.int(np.random.random() * col) + 1
+            partition = int(np.random.random() * col) + 1
             w[:, partition:] = B_w[:, partition:]
         return child
 
@@ -98,23 +132,91 @@ class NeuralNetwork:
             (media = 0, desvio padrão = stdDev)
         """
         for w in self.weights:
-            rows, cols = w.shape
-            for i, j in product(range(rows), range(cols)):
-                if np.random.rand() < prob:
-                    w[i, j] += np.random.randn() * stdDev
-
-                    # Caso o valor, após a mutação, exceda os limites, é ajustado
-                    absW = abs(w[i,j])
-                    if absW > W_MAX:
-                        w[i,j] = W_MAX * np.sign(w[i,j])
-                    elif absW < W_MIN:
-                        w[i,j] = 0.0
+            idx = np.unravel_index(mutationIndices(w.size, prob), w.shape)
+            mutated = w[idx] + np.random.randn(len(idx[0])) * stdDev
+
+            # Caso o valor, após a mutação, exceda os limites, é ajustado
+            w[idx] = clipWeights(mutated)
 
     def copy(self):
         """ Retorna uma cópia da rede neural
         """
-        nNN = NeuralNetwork(self.shape)
-        for i,w in enumerate(self.weights):
-            nNN.weights[i] = w.copy()
-        return nNN
+        return NeuralNetwork(self.shape, [w.copy() for w in self.weights])
+
+    def freeze(self, sparse=0.0):
+        """ Retorna uma FrozenNetwork com uma cópia dos pesos atuais, para
+            inferência de um estado por vez (ver FrozenNetwork para 'sparse')
+        """
+        return FrozenNetwork(self.weights, sparse)
+
+
+class FrozenNetwork:
+    """ Forma compilada de uma NeuralNetwork, apenas para inferência de um
+        estado por vez: os pesos são separados em W e b (a linha do bias)
+        em float32, e cada layer escreve em um buffer alocado uma única vez
+        (com out=), sem o hstack do bias e sem criar arrays a cada decisão.
+        Os pesos são copiados: alterações na rede original não são vistas.
+
+        O state tem valores em {-1, 0, 1}, quase todos 0. Com 'sparse' > 0,
+        se a fração de células não nulas for no máximo 'sparse', o primeiro
+        layer soma as linhas de W das células com 1 e subtrai as das
+        células com -1 (o produto dos valores não nulos pelas linhas
+        correspondentes), em vez do produto pela matriz inteira. Estados
+        mais cheios usam o produto denso. O ponto em que o modo esparso
+        deixa de compensar depende da máquina: ver 'benchmark.py --density'
+    """
+    def __init__(self, weights, sparse=0.0):
+        self.W = [np.ascontiguousarray(w[1:], dtype=np.float32) for w in weights]
+        self.b = [np.array(w[0], dtype=np.float32) for w in weights]
+        self.input = np.empty(self.W[0].shape[0], dtype=np.float32)
+        self.layers = [np.empty(W.shape[1], dtype=np.float32) for W in self.W]
+
+        # Máximo de células não nulas para o primeiro layer esparso
+        self.sparse_max = int(sparse * len(self.input)) if sparse > 0 else -1
+        self.sparse = self.dense = 0
+
+    def forward(self, state, last=True):
+        """ Feedforward de um estado. Sem 'last', a função de ativação não
+            é aplicada no último layer. Retorna o buffer do último layer,
+            que é sobrescrito na próxima chamada
+        """
+        np.copyto(self.input, np.ravel(state), casting='unsafe')
+        curr = self.input
+        for i, (W, b, out) in enumerate(zip(self.W, self.b, self.layers)):
+            if i == 0 and self.sparse_max >= 0:
+                self.firstLayer(out)
+            else:
+                np.matmul(curr, W, out=out)
+            out += b
+            if last or i < len(self.W) - 1:
+                # sigmoid(z) = (tanh(z/2) + 1)/2, sem overflow no exp
+                out *= 0.5
+                np.tanh(out, out=out)
+                out *= 0.5
+                out += 0.5
+            curr = out
+        return curr
+
+    def firstLayer(self, out):
+        """ Produto do input pelo primeiro W, esparso ou denso conforme o
+            número de células não nulas
+        """
+        cells = np.flatnonzero(self.input)
+        if len(cells) <= self.sparse_max:
+            np.matmul(self.input[cells], self.W[0][cells], out=out)
+            self.sparse += 1
+        else:
+            np.matmul(self.input, self.W[0], out=out)
+            self.dense += 1
+
+    def predict(self, state):
+        """ Saída da rede para um estado, como NeuralNetwork.predict([state])
+        """
+        return self.forward(state)[None].copy()
+
+    def act(self, state):
+        """ Índice da ação escolhida (maior saída). A sigmoid é monotônica,
+            então não é aplicada no último layer
+        """
+        return int(self.forward(state, last=False).argmax())
 
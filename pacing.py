@@ -0,0 +1,107 @@
+import time
+import threading
+
+'''
+Ritmo da simulação e exibição da tela em play.py.
+
+O Pacer marca o prazo de cada frame no relógio monotônico, a partir do
+início da partida (e não do fim do frame anterior), para que o atraso de
+um frame não se acumule nos seguintes. Quando a simulação está atrasada,
+o frame é emulado sem espera; se o atraso passar de MAX_LAG, os prazos
+recomeçam do instante atual, em vez de emular uma rajada de frames.
+
+A tela é desenhada pelo RenderThread, que exibe sempre o frame mais
+recente: se a exibição for mais lenta que a simulação, frames são
+descartados, e o ritmo da simulação não muda.
+'''
+
+# Atraso máximo (s) recuperado emulando frames sem espera
+MAX_LAG = 0.25
+
+
+class Pacer:
+    def __init__(self, fps, speed=1.0):
+        """ 'fps' frames por segundo multiplicados por 'speed'
+        (speed <= 0: sem limite)
+        """
+        self.target = fps * speed if speed > 0 else float('inf')
+        self.period = 1 / self.target if speed > 0 else 0.0
+
+        self.start = time.monotonic()
+        self.deadline = self.start
+        self.frames = 0
+        self.late = 0   # frames emulados sem espera por atraso
+        self.resets = 0 # vezes em que o atraso passou de MAX_LAG
+
+    def wait(self):
+        """ Espera até o prazo do próximo frame
+        """
+        self.frames += 1
+        if self.period == 0:
+            return
+
+        self.deadline += self.period
+        now = time.monotonic()
+        if now < self.deadline:
+            time.sleep(self.deadline - now)
+        else:
+            self.late += 1
+            if now - self.deadline > MAX_LAG:
+                self.deadline = now
+                self.resets += 1
+
+    def fps(self):
+        """ Frames por segundo alcançados desde o início
+        """
+        return self.frames / max(time.monotonic() - self.start, 1e-9)
+
+
+class RenderThread:
+    """ Exibe, em uma thread própria, o frame mais recente recebido por show()
+    """
+    def __init__(self):
+        self.frame = None
+        self.closed = False
+        self.cond = threading.Condition()
+
+        self.received = 0
+        self.shown = 0
+        self.seconds = 0.0 # tempo gasto desenhando, nesta thread
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def show(self, frame):
+        """ Entrega um frame para ser exibido, descartando o anterior se
+        ele ainda não foi desenhado. Não bloqueia
+        """
+        with self.cond:
+            self.frame = frame
+            self.received += 1
+            self.cond.notify()
+
+    def run(self):
+        # o pyglet (importado por retro.rendering) e a janela são criados,
+        # usados e fechados apenas nesta thread; play.py não chama env.render
+        from retro.rendering import SimpleImageViewer
+        viewer = SimpleImageViewer()
+        try:
+            while True:
+                with self.cond:
+                    while self.frame is None and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    frame, self.frame = self.frame, None
+                t = time.perf_counter()
+                viewer.imshow(frame)
+                self.seconds += time.perf_counter() - t
+                self.shown += 1
+        finally:
+            viewer.close()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
@@ -2,12 +2,14 @@ import os
 import sys
 import retro
 import argparse
-import numpy as np
 from nn import *
 from utils import *
 from rominfo import *
 from agent import Agent
-import time
+import profiler
+import traces
+from pacing import Pacer, RenderThread
+import cProfile
 
 # ARGPARSER - Recebe argumentos por linha de comando #
 parser = argparse.ArgumentParser(
@@ -17,6 +19,14 @@ parser.add_argument("-a", "--agent", type=str, metavar='',
                     help="agente em 'agents/'", default='current')
 parser.add_argument("-l", "--level", type=str, metavar='',
                     help="fase", default='YoshiIsland2')
+parser.add_argument("-P", "--profile", help="medir o tempo de cada fase do laço", action="store_true")
+parser.add_argument("--pstats", type=str, metavar='',
+                    help="salvar o cProfile da partida neste arquivo", default=None)
+parser.add_argument("-r", "--replay", type=str, metavar='',
+                    help="reproduzir as decisões gravadas neste arquivo (sem a rede neural)", default=None)
+parser.add_argument("-f", "--fast", help="no --replay, reproduzir sem tela e sem espera, conferindo o resultado", action="store_true")
+parser.add_argument("-x", "--speed", type=float, metavar='',
+                    help="velocidade em relação ao jogo (ex.: 2 para 2x; 0 sem limite)", default=1.0)
 args = parser.parse_args()
 
 radius = 6
@@ -26,38 +36,54 @@ output_size = len(actions_list)
 topology = [input_size, 64, output_size]
 
 
-def play(agent, printstate, level):
+def play(agent, printstate, level, profile=False, speed=1.0):
     """ O agente joga a fase. A simulação é interrompida quando o agente
     vence o level, morre, ou fica parado sem ter progresso por muito tempo.
     Após o término da simulação, o score do agente é calculado e ele
-    é retornado.
+    é retornado. 'speed' multiplica o fps do jogo (0: sem limite).
+    Com 'profile', imprime o tempo de cada fase do laço (a fase do
+    emulador inclui a espera para manter o fps, e a de render apenas a
+    entrega dos frames ao RenderThread, que os desenha em paralelo).
     """
 
     env = retro.make(game='SuperMarioWorld-Snes', state=level, players=1)
     env.mode = 'normal'
 
+    net = agent.brain.freeze()
+
     points = 0
+    frames = 0
+    prof = profiler.Profiler() if profile else profiler.NullProfiler()
+
+    pacer = Pacer(fps, speed)
+    renderer = RenderThread()
 
     try:
-        t = time.time()
         env.reset()
+        ram_view = RamView(env)
 
         while True:
-            ram = getRam(env)
+            prof.count(profiler.DECISIONS)
+            ram = ram_view.refresh()
+            prof.lap(profiler.RAM)
+            prof.sprites(ram)
             state, x, y = getState(ram, radius)
+            prof.lap(profiler.STATE)
 
             if printstate:
                 printState(state, radius)
 
             agent.setPos(x, y)
             
-            food = [state]
-            act_idx = np.argmax(agent.brain.predict(food))
+            prof.lap(profiler.CONTROL)
+            act_idx = net.act(state)
             action = actions_list[act_idx]
+            prof.lap(profiler.PREDICT)
 
             # Agente bate em bloco de mensagem
             if ram[0x1426] != 0:
-                performAction(1, env)
+                performActionPaced(1, env, pacer, renderer, prof)
+                frames += frameCount(1)
                 action = 0
 
             is_dead = agent.is_stoped() or ram[0x0DDA] == 0xff
@@ -65,23 +91,58 @@ def play(agent, printstate, level):
             if is_dead and ram[0x1493] == 0x00:
                 break
 
-            reward, done, info, new_t = performActionWithDelay(action, env, t)
+            prof.lap(profiler.CONTROL)
+            reward, done, info = performActionPaced(action, env, pacer, renderer, prof)
+            prof.lap(profiler.EMULATOR)
 
             points += reward
-
-            env.render()
-            
-            t = new_t
+            frames += frameCount(action)
 
     finally:
-        env.render(close=True)
+        renderer.close()
         env.close()
 
+    printPacing(pacer, renderer)
+
+    if profile:
+        prof.finish(frames)
+        print(profiler.report(prof.values()))
+
     agent.points = points
     agent.setScore()
     return agent
 
 
+def replay(trace_file, fast, speed=1.0):
+    """ Reproduz as decisões gravadas em 'trace_file' (ver traces.py), sem
+    extrair o state nem usar a rede neural. Com 'fast', o emulador roda
+    sem tela e sem espera. Retorna o Trace e o resultado da reprodução
+    (pontos, frames, distância)
+    """
+    trace = traces.load(trace_file)
+
+    env = retro.make(game='SuperMarioWorld-Snes', state=trace.level, players=1)
+    env.mode = 'fast' if fast else 'normal'
+
+    try:
+        env.reset()
+        if fast:
+            result = traces.replay(env, trace, performAction, track=True)
+        else:
+            pacer = Pacer(fps, speed)
+            renderer = RenderThread()
+            try:
+                result = traces.replay(env, trace, lambda a, env: performActionPaced(a, env, pacer, renderer),
+                                       track=True)
+            finally:
+                renderer.close()
+            printPacing(pacer, renderer)
+    finally:
+        env.close()
+
+    return trace, result
+
+
 def load_player(play_file):
     """ Carrega o agente salvo em 'play_file', ou cria um novo
     agente caso esse não exista
@@ -95,44 +156,56 @@ def load_player(play_file):
 
 def main():
 
+    if args.replay is not None:
+        trace, (points, frames, max_x) = replay(args.replay, args.fast, args.speed)
+        same = (points, frames, max_x) == (trace.points, trace.frames, trace.max_x)
+        print("Replay: {} decisões | Points: {:,.0f} (gravado {:,.0f}) | Frames: {:,} (gravado {:,}) | Distance: {:,} (gravado {:,}) | {}".format(
+            len(trace.decisions), points, trace.points, frames, trace.frames, max_x, trace.max_x,
+            "OK" if same else "DIVERGENTE"))
+        if not same:
+            sys.exit(1)
+        return
+
     printstate = args.show
     level = args.level
     play_file = "agents/"+args.agent+".pkl"
     agent = load_player(play_file)
     agent.reset()
 
-    play(agent, printstate, level)
+    if args.pstats is not None:
+        stats = cProfile.Profile()
+        stats.runcall(play, agent, printstate, level, args.profile, args.speed)
+        stats.dump_stats(args.pstats)
+    else:
+        play(agent, printstate, level, args.profile, args.speed)
     print("Agent Report")
     print("Fitness: {:.3f} | Points: {:6,.0f} | Distance: {:4,.0f}".format(
         agent.fitness, agent.points, agent.max_x))
     print("---------------------------------------------------")
 
-def maybeDelay(t):
-    new_t = time.time()
-    dt = t - new_t
-    if  dt > 0:
-        time.sleep(dt)
-    return t + period
-
-def performActionWithDelay(a, env, t):
+def performActionPaced(a, env, pacer, renderer, prof=profiler.NullProfiler()):
+    """ Como performAction, mas cada frame é entregue a 'renderer' e
+    emulado no ritmo de 'pacer'. A entrega é medida na fase de render
+    de 'prof', e o restante na do emulador
+    """
     reward = 0
     bin_a = dec2bin(a)
-    if a in long_actions:
-        for it in range(8):
-            ob, rew, done, info = env.step(bin_a)
-            t = maybeDelay(t)
-            reward += rew
-           
-    elif a in short_actions:
-        for it in range(4):
-            ob, rew, done, info = env.step(bin_a)
-            t = maybeDelay(t)
-            reward += rew
-    else:
+    for it in range(frameCount(a)):
         ob, rew, done, info = env.step(bin_a)
-        t = maybeDelay(t)
+        prof.lap(profiler.EMULATOR)
+        renderer.show(ob)
+        prof.lap(profiler.RENDER)
+        pacer.wait()
         reward += rew
-    return reward, done, info, t
+    return reward, done, info
+
+def printPacing(pacer, renderer):
+    """ Imprime o fps alcançado e o exibido, comparados ao alvo
+    """
+    target = "{:.1f}".format(pacer.target) if pacer.period > 0 else "sem limite"
+    print("FPS: {:.1f} alcançados (alvo {}) | {} frames atrasados, {} reinícios do ritmo | tela: {} de {} frames exibidos ({:.1f}ms por frame desenhado)".format(
+        pacer.fps(), target, pacer.late, pacer.resets, renderer.shown, renderer.received,
+        1000*renderer.seconds/max(renderer.shown, 1)))
 
 if __name__ == "__main__":
     try:
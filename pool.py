@@ -0,0 +1,157 @@
+import time
+import multiprocessing as mp
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+Pool persistente de avaliação.
+
+Os processos do pool sobrevivem entre gerações e cada um mantém o seu
+emulador aberto (o retro permite apenas um por processo). Entre episódios
+o emulador é apenas resetado para o savestate do level; um novo só é
+criado quando o level muda.
+'''
+
+# Emulador do processo atual e level para o qual foi criado
+env = None
+env_level = None
+
+# Emuladores criados apenas com observações da RAM, ver initHeadless
+headless = False
+
+# Custos acumulados (compartilhados com o processo principal), ver COSTS
+costs = None
+COSTS = ['emuladores', 'tempo de criação', 'episódios', 'tempo de reset', 'jobs', 'tempo ocupado']
+
+# Barreira em que os workers esperam uns aos outros no início, ver waitReady
+ready = None
+
+
+def initWorker(shared_costs, barrier, initializers):
+    """ Initializer dos processos do pool. 'initializers' é uma lista de
+    pares (função, argumentos) executados em seguida
+    """
+    global costs, ready
+    costs = shared_costs
+    ready = barrier
+
+    # fecha o emulador quando o processo terminar
+    Finalize(None, closeEnv, exitpriority=10)
+
+    for initializer, initargs in initializers:
+        initializer(*initargs)
+
+
+def initHeadless():
+    """ Initializer dos workers: os emuladores passam a ser criados com
+    observações apenas da RAM (sem copiar a tela a cada frame)
+    """
+    global headless
+    headless = True
+
+
+def getEnv(level):
+    """ Retorna o emulador do processo, já resetado no início do level
+    """
+    global env, env_level
+    if env is None or env_level != level:
+        # importado aqui para que o módulo possa ser usado sem o retro
+        # (ex.: benchmark.py, que injeta um emulador simulado em 'env')
+        import retro
+
+        closeEnv()
+        t = time.perf_counter()
+        obs_type = retro.Observations.RAM if headless else retro.Observations.IMAGE
+        env = retro.make(game='SuperMarioWorld-Snes', state=level, players=1, obs_type=obs_type)
+        env.mode = 'fast'
+        env_level = level
+        addCost(0, 1, time.perf_counter() - t)
+
+    t = time.perf_counter()
+    env.reset()
+    addCost(2, 1, time.perf_counter() - t)
+    return env
+
+
+def restoreState(env, snapshot):
+    """ Carrega um savestate obtido com env.em.get_state() no meio de um
+    episódio. Como em env.reset(), as variáveis usadas no cálculo da
+    recompensa são reiniciadas a partir da RAM restaurada
+    """
+    env.em.set_state(snapshot)
+    env.data.reset()
+    env.data.update_ram()
+
+
+def closeEnv():
+    global env, env_level
+    if env is not None:
+        env.close()
+    env = env_level = None
+
+
+def waitReady():
+    """ Job de início: termina quando todos os workers do pool o estão
+    executando, de modo que cada worker recebe exatamente um
+    """
+    ready.wait()
+
+
+def runJob(fn, args, kwargs):
+    """ Executa um job no worker, somando o tempo gasto ao tempo ocupado
+    """
+    t = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        addCost(4, 1, time.perf_counter() - t)
+
+
+def addCost(idx, count, seconds):
+    if costs is None:
+        return
+    with costs.get_lock():
+        costs[idx] += count
+        costs[idx + 1] += seconds
+
+
+class EvaluationPool:
+    def __init__(self, processes, initializers=()):
+        self.costs = mp.Array('d', len(COSTS))
+
+        t = time.perf_counter()
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=initWorker,
+                                            initargs=(self.costs, mp.Barrier(processes), list(initializers)))
+
+        # Os processos só são criados no primeiro submit: um waitReady por
+        # worker força a criação de todos e espera os imports e initializers
+        # de cada um, que fazem parte do tempo de início
+        for future in [self.executor.submit(waitReady) for i in range(processes)]:
+            future.result()
+        self.startup = time.perf_counter() - t
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(runJob, fn, args, kwargs)
+
+    def report(self):
+        """ Retorna e zera os custos acumulados pelos workers desde o
+        último report, como um dicionário indexado por COSTS
+        """
+        with self.costs.get_lock():
+            values = dict(zip(COSTS, self.costs[:]))
+            self.costs[:] = [0.0]*len(COSTS)
+        return values
+
+    def close(self):
+        """ Encerra os workers (e seus emuladores), retornando o tempo gasto
+        """
+        t = time.perf_counter()
+        self.executor.shutdown(wait=True)
+        return time.perf_counter() - t
+
+    def kill(self):
+        """ Encerra os workers imediatamente (ex.: após CTRL + C)
+        """
+        for process in list((self.executor._processes or {}).values()):
+            process.kill()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,152 @@
+import numpy as np
+from multiprocessing import shared_memory
+from nn import NeuralNetwork, MUT_RATE, MUT_AMMOUNT, mutationIndices, clipWeights
+
+
+class Population:
+    """ População armazenada como um único array contíguo (agentes x pesos).
+    Cada linha é o genoma de um agente: as matrizes peso da rede neural,
+    achatadas e concatenadas na ordem dos layers. As NeuralNetworks
+    criadas por brain() usam views para essa linha, sem cópia.
+    """
+    def __init__(self, topology:list, genomes):
+        self.shape = topology.copy()
+
+        # (linhas, colunas) de cada matriz peso e seu intervalo no genoma
+        self.layers = [(topology[i]+1, topology[i+1]) for i in range(len(topology)-1)]
+        self.bounds = np.cumsum([0] + [r*c for r, c in self.layers])
+
+        self.genomes = np.ascontiguousarray(genomes, dtype=np.float64)
+
+    @staticmethod
+    def fromAgents(agents):
+        """ Cria uma população copiando os pesos de uma lista de agentes
+        """
+        genomes = np.stack([np.concatenate([w.ravel() for w in a.brain.weights]) for a in agents])
+        return Population(agents[0].brain.shape, genomes)
+
+    def __len__(self):
+        return len(self.genomes)
+
+    def weights(self, i):
+        """ Matrizes peso do agente i (views para o genoma)
+        """
+        genome = self.genomes[i]
+        return [genome[lo:hi].reshape(shape)
+                for shape, lo, hi in zip(self.layers, self.bounds, self.bounds[1:])]
+
+    def brain(self, i):
+        """ NeuralNetwork do agente i, compartilhando memória com o genoma
+        """
+        return NeuralNetwork(self.shape, self.weights(i))
+
+    def take(self, idx):
+        """ Nova população com cópias dos genomas em 'idx'
+        """
+        return Population(self.shape, self.genomes[idx])
+
+    def mutation(self, prob=MUT_RATE, stdDev=MUT_AMMOUNT):
+        """ Mutação de toda a população de uma só vez. Cada peso tem uma
+        chance (prob) de sofrer uma mutação normal com desvio padrão
+        stdDev, que pode ser um valor por agente
+        """
+        flat = self.genomes.reshape(-1)
+        idx = mutationIndices(flat.size, prob)
+
+        stdDev = np.asarray(stdDev, dtype=np.float64)
+        if stdDev.ndim > 0:
+            stdDev = stdDev[idx // self.genomes.shape[1]]
+
+        flat[idx] = clipWeights(flat[idx] + np.random.randn(len(idx)) * stdDev)
+
+    def select(self, prob, n):
+        """ Sorteia n índices de agentes, proporcionalmente a 'prob'
+        """
+        return np.random.choice(len(self), size=n, p=prob)
+
+    def crossover(self, A, B):
+        """ Crossover em lote: o filho k herda as primeiras colunas de cada
+        matriz peso do agente A[k] e as restantes do agente B[k], com um
+        ponto de partição sorteado por matriz (como em NeuralNetwork.crossover)
+        """
+        A, B = np.asarray(A), np.asarray(B)
+        n = len(A)
+        children = self.genomes[A]
+        for (rows, cols), lo, hi in zip(self.layers, self.bounds, self.bounds[1:]):
+            partition = (np.random.random(n) * cols).astype(int) + 1
+            from_B = np.arange(cols)[None, None, :] >= partition[:, None, None]
+            np.copyto(children[:, lo:hi].reshape(n, rows, cols),
+                      self.genomes[B, lo:hi].reshape(n, rows, cols), where=from_B)
+        return Population(self.shape, children)
+
+
+# Genomas compartilhados do processo atual, definido por initWorker
+shared = None
+
+# Outros blocos de genomas abertos pelo processo, ver attach
+attached = {}
+
+
+def initWorker(*spec):
+    """ Initializer dos workers: conecta o processo aos genomas compartilhados
+    """
+    global shared
+    shared = SharedPopulation(*spec)
+
+
+def attach(topology, capacity, name):
+    """ Retorna os genomas compartilhados do bloco 'name' (argumentos de
+    SharedPopulation.spec), conectando o processo a ele na primeira vez.
+    O bloco continua aberto até retain
+    """
+    genomes = attached.get(name)
+    if genomes is None:
+        genomes = attached[name] = SharedPopulation(topology, capacity, name)
+    return genomes
+
+
+def retain(names):
+    """ Fecha os blocos abertos por attach que não estão em 'names' (os
+    das populações que ainda serão avaliadas)
+    """
+    for name in [n for n in attached if n not in names]:
+        attached.pop(name).close()
+
+
+class SharedPopulation(Population):
+    """ Population cujos genomas ficam em um bloco de memória compartilhada
+    (multiprocessing.shared_memory). O processo principal escreve os genomas
+    e os workers os leem diretamente, recebendo apenas o índice do agente.
+    """
+    def __init__(self, topology:list, capacity, name=None):
+        nparams = sum((topology[i]+1)*topology[i+1] for i in range(len(topology)-1))
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=capacity*nparams*8)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        genomes = np.ndarray((capacity, nparams), dtype=np.float64, buffer=self.shm.buf)
+        super().__init__(topology, genomes)
+
+    def spec(self):
+        """ Argumentos para conectar outro processo a este bloco
+        """
+        return (self.shape, len(self), self.shm.name)
+
+    def load(self, agents):
+        """ Copia os pesos dos agentes para as linhas 0..len(agents)-1
+        """
+        for i, agent in enumerate(agents):
+            self.store(i, agent)
+
+    def store(self, i, agent):
+        """ Copia os pesos do agente para a linha i
+        """
+        np.concatenate([w.ravel() for w in agent.brain.weights], out=self.genomes[i])
+
+    def close(self, unlink=False):
+        self.genomes = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
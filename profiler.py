@@ -0,0 +1,136 @@
+import os
+import time
+import cProfile
+import multiprocessing as mp
+import numpy as np
+from multiprocessing.util import Finalize
+from rominfo import getSpriteArrays
+
+'''
+Instrumentação opcional do laço de decisão (train_level e play.play).
+
+O Profiler acumula o tempo de cada fase do laço (com time.perf_counter,
+marcando o fim de cada fase com lap) e alguns contadores. Nos workers, os
+totais de cada episódio são somados a um array compartilhado com o
+processo principal, que os reporta por geração (como os custos do pool).
+Em um worker remoto, esses totais vão para o coordenador com os resultados.
+Opcionalmente, cada worker grava um arquivo .pstats do cProfile.
+'''
+
+# Fases do laço
+EMULATOR, RAM, STATE, PREDICT, CONTROL, RENDER = range(6)
+PHASES = ['emulador', 'getRam', 'getState', 'predict', 'controle', 'render']
+
+# Contadores
+EPISODES, DECISIONS, FRAMES, READS, SPRITES = range(5)
+COUNTERS = ['episódios', 'decisões', 'frames emulados', 'leituras da RAM', 'sprites']
+
+# Totais compartilhados do processo atual, definidos por initWorker
+totals = None
+
+
+def initWorker(shared_totals, pstats_dir=None):
+    """ Initializer dos workers: ativa o profiler no processo e,
+    se 'pstats_dir' for dado, o cProfile
+    """
+    global totals
+    totals = shared_totals
+
+    if pstats_dir is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+        filename = os.path.join(pstats_dir, "worker-{}.pstats".format(os.getpid()))
+        Finalize(None, dumpStats, args=(profile, filename), exitpriority=20)
+
+
+def dumpStats(profile, filename):
+    profile.disable()
+    profile.dump_stats(filename)
+
+
+def sharedTotals():
+    """ Array compartilhado para os totais dos workers
+    """
+    return mp.Array('d', len(PHASES) + len(COUNTERS))
+
+
+def collect(shared_totals):
+    """ Retorna e zera os totais acumulados pelos workers
+    """
+    with shared_totals.get_lock():
+        values = np.array(shared_totals[:])
+        shared_totals[:] = [0.0]*len(values)
+    return values
+
+
+def start():
+    """ Profiler para um episódio, ou um NullProfiler se desativado
+    """
+    return Profiler() if totals is not None else NullProfiler()
+
+
+class Profiler:
+    def __init__(self):
+        self.times = np.zeros(len(PHASES))
+        self.counts = np.zeros(len(COUNTERS))
+        self.t = time.perf_counter()
+
+    def lap(self, phase):
+        """ Atribui à fase 'phase' o tempo desde o último lap
+        """
+        now = time.perf_counter()
+        self.times[phase] += now - self.t
+        self.t = now
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def sprites(self, ram):
+        """ Conta os sprites na tela; o tempo gasto não entra em nenhuma fase
+        """
+        self.counts[READS] += 1
+        self.counts[SPRITES] += len(getSpriteArrays(ram)[0])
+        self.t = time.perf_counter()
+
+    def finish(self, frames):
+        """ Encerra o episódio, somando os totais aos do processo
+        """
+        self.counts[EPISODES] += 1
+        self.counts[FRAMES] += frames
+        if totals is None:
+            return
+        with totals.get_lock():
+            totals[:] = (np.array(totals[:]) + self.values()).tolist()
+
+    def values(self):
+        return np.concatenate([self.times, self.counts])
+
+
+class NullProfiler:
+    def lap(self, phase):
+        pass
+
+    def count(self, counter, n=1):
+        pass
+
+    def sprites(self, ram):
+        pass
+
+    def finish(self, frames):
+        pass
+
+
+def report(values):
+    """ Texto com a divisão do tempo por fase e os contadores
+    """
+    times, counts = values[:len(PHASES)], values[len(PHASES):]
+    total = max(sum(times), 1e-9)
+    decisions = max(counts[DECISIONS], 1)
+    reads = max(counts[READS], 1)
+
+    phases = " | ".join("{} {:.0%} ({:.2f}s)".format(name, t/total, t) for name, t in zip(PHASES, times))
+    python = total - times[EMULATOR] - times[RENDER]
+    return ("Perfil: {}\n"
+            "        {:,.0f} episódios | {:,.0f} decisões | {:,.0f} frames emulados | {:.1f} sprites por leitura da RAM | {:.0f} us/decisão fora o emulador").format(
+        phases, counts[EPISODES], counts[DECISIONS], counts[FRAMES],
+        counts[SPRITES]/reads, 1e6*python/decisions)
@@ -0,0 +1,354 @@
+import os
+import time
+import socket
+import itertools
+import threading
+import traceback
+import numpy as np
+from collections import deque
+from concurrent.futures import Future, BrokenExecutor
+from multiprocessing.connection import Listener, Client
+from pool import COSTS
+import profiler
+
+'''
+Avaliação distribuída em várias máquinas, por TCP.
+
+O coordenador (RemotePool) tem a mesma interface do EvaluationPool: cada
+submit cria um job com uma cópia do genoma do agente e os argumentos do
+episódio, que fica em uma fila até ser enviado a um worker. Os workers
+(runWorker, em 'python train.py --worker host:porta') avaliam os jobs no
+seu próprio EvaluationPool e devolvem o resultado de cada um.
+
+Protocolo: mensagens (tuplas) do multiprocessing.connection, autenticadas
+com uma chave compartilhada.
+  worker -> coordenador: ('hello', nome, slots), ('result', job, resultado, perfil),
+                         ('error', job, traceback, perfil), ('heartbeat', custos)
+  coordenador -> worker: ('jobs', [(job, genoma, argumentos), ...]), ('stop',)
+
+Cada worker tem 'slots' jobs em andamento no máximo (alguns a mais que o
+número de processos, para que nenhum fique ocioso esperando a rede). Os
+jobs são enviados em lotes, até o número de slots livres. Um worker que
+não envia nenhuma mensagem por TIMEOUT segundos (ou cuja conexão cai) é
+descartado, e os seus jobs voltam para o início da fila.
+
+Se o worker foi iniciado com --profile, cada resultado leva os totais do
+profiler (ver profiler.py) acumulados desde o anterior: os tempos de um
+episódio chegam ao coordenador antes (ou junto) do seu resultado.
+'''
+
+# Intervalo entre heartbeats e tempo sem mensagens para descartar um worker (s)
+HEARTBEAT = 2.0
+TIMEOUT   = 10.0
+
+# Jobs por processo mantidos em cada worker
+PREFETCH = 2
+
+
+class RemoteError(Exception):
+    """ Exceção levantada em um worker remoto durante um job
+    """
+
+
+def parseAddress(address):
+    """ 'host:porta' -> (host, porta)
+    """
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class WorkerInfo:
+    def __init__(self, conn, name, slots):
+        self.conn = conn
+        self.name = name
+        self.slots = slots
+        self.free = slots
+        self.running = set()
+        self.last_seen = time.monotonic()
+        self.send_lock = threading.Lock()
+
+    def send(self, msg):
+        with self.send_lock:
+            self.conn.send(msg)
+
+
+class RemotePool:
+    def __init__(self, address, authkey, genomes):
+        """ Aguarda workers em 'address' (host, porta). 'genomes' são os
+        genomas compartilhados (SharedPopulation), de onde é copiado o
+        genoma de cada job
+        """
+        self.genomes = genomes
+        self.listener = Listener(address, authkey=authkey)
+        self.startup = 0.0
+
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.jobs = {}        # job -> (future, genoma, argumentos)
+        self.queue = deque()  # jobs aguardando um worker
+        self.workers = {}     # conexão -> WorkerInfo
+        self.closed = False
+
+        self.costs = dict.fromkeys(COSTS, 0.0)
+        self.profile = None   # totais do profiler enviados pelos workers, ver collectProfile
+        self.stats = dict.fromkeys(['conectados', 'perdidos', 'jobs', 'lotes', 'reenviados'], 0)
+
+        for target in (self.accept, self.monitor):
+            threading.Thread(target=target, daemon=True).start()
+
+    def submit(self, fn, agent_id, **kwargs):
+        """ Cria um job para o agente 'agent_id'. Os workers executam sempre
+        a função passada a runWorker ('fn' existe apenas para manter a
+        interface do EvaluationPool)
+        """
+        future = Future()
+        genome = self.genomes.genomes[agent_id].copy()
+        with self.lock:
+            job = next(self.ids)
+            self.jobs[job] = (future, genome, kwargs)
+            self.queue.append(job)
+        self.dispatch()
+        return future
+
+    def dispatch(self):
+        """ Envia jobs da fila aos workers com slots livres, em lotes
+        """
+        with self.lock:
+            batches = []
+            for worker in self.workers.values():
+                if not self.queue:
+                    break
+                batch = []
+                while worker.free > 0 and self.queue:
+                    job = self.queue.popleft()
+                    if job not in self.jobs:
+                        continue
+                    future, genome, kwargs = self.jobs[job]
+                    batch.append((job, genome, kwargs))
+                    worker.running.add(job)
+                    worker.free -= 1
+                if batch:
+                    batches.append((worker, batch))
+                    self.stats['jobs'] += len(batch)
+                    self.stats['lotes'] += 1
+
+        for worker, batch in batches:
+            try:
+                worker.send(('jobs', batch))
+            except (OSError, ValueError):
+                self.lose(worker)
+
+    def accept(self):
+        while not self.closed:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                if self.closed:
+                    return
+                continue
+            except Exception:
+                # chave incorreta ou conexão interrompida na autenticação
+                continue
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        """ Recebe as mensagens de um worker
+        """
+        worker = None
+        try:
+            kind, name, slots = conn.recv()
+            if kind != 'hello':
+                conn.close()
+                return
+            worker = WorkerInfo(conn, name, slots)
+            with self.lock:
+                self.workers[conn] = worker
+                self.stats['conectados'] += 1
+            print("Worker conectado: {} ({} slots)".format(name, slots))
+            self.dispatch()
+
+            while True:
+                msg = conn.recv()
+                worker.last_seen = time.monotonic()
+                if msg[0] == 'heartbeat':
+                    with self.lock:
+                        for k, v in msg[1].items():
+                            self.costs[k] += v
+                elif msg[0] in ('result', 'error'):
+                    self.finish(worker, *msg)
+        except (EOFError, OSError, ValueError):
+            pass
+        finally:
+            if worker is not None:
+                self.lose(worker)
+            conn.close()
+
+    def finish(self, worker, kind, job, value, totals):
+        with self.lock:
+            worker.running.discard(job)
+            worker.free += 1
+            entry = self.jobs.pop(job, None)
+            if totals is not None:
+                totals = np.array(totals)
+                self.profile = totals if self.profile is None else self.profile + totals
+        # resultados de jobs já concluídos por outro worker são ignorados
+        if entry is not None:
+            future = entry[0]
+            if kind == 'result':
+                future.set_result(value)
+            else:
+                future.set_exception(RemoteError(value))
+        self.dispatch()
+
+    def monitor(self):
+        """ Descarta os workers que pararam de enviar heartbeats
+        """
+        while not self.closed:
+            time.sleep(HEARTBEAT)
+            now = time.monotonic()
+            for worker in list(self.workers.values()):
+                if now - worker.last_seen > TIMEOUT:
+                    self.lose(worker)
+
+    def lose(self, worker):
+        """ Remove o worker, devolvendo os seus jobs ao início da fila
+        """
+        with self.lock:
+            if self.workers.pop(worker.conn, None) is None:
+                return
+            requeue = [job for job in worker.running if job in self.jobs]
+            self.queue.extendleft(requeue)
+            worker.running.clear()
+            self.stats['perdidos'] += 1
+            self.stats['reenviados'] += len(requeue)
+        if not self.closed:
+            print("Worker perdido: {} ({} jobs reenviados para a fila)".format(worker.name, len(requeue)))
+        try:
+            worker.conn.close()
+        except OSError:
+            pass
+        self.dispatch()
+
+    def report(self):
+        """ Retorna e zera os custos enviados pelos workers, como um
+        dicionário indexado por COSTS (ver EvaluationPool.report)
+        """
+        with self.lock:
+            values, self.costs = self.costs, dict.fromkeys(COSTS, 0.0)
+        return values
+
+    def collectProfile(self):
+        """ Retorna e zera os totais do profiler enviados pelos workers
+        (ver profiler.collect), ou None se nenhum worker os enviou
+        """
+        with self.lock:
+            values = self.profile
+            if values is not None:
+                self.profile = np.zeros_like(values)
+        return values
+
+    def summary(self):
+        """ Retorna e zera as estatísticas de envio de jobs
+        """
+        with self.lock:
+            stats = dict(self.stats, workers=len(self.workers))
+            for k in self.stats:
+                if k != 'conectados':
+                    self.stats[k] = 0
+        return stats
+
+    def close(self):
+        """ Encerra os workers conectados, retornando o tempo gasto
+        """
+        t = time.perf_counter()
+        self.closed = True
+        for worker in list(self.workers.values()):
+            try:
+                worker.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        self.listener.close()
+        return time.perf_counter() - t
+
+    def kill(self):
+        if not self.closed:
+            self.close()
+        for worker in list(self.workers.values()):
+            try:
+                worker.conn.close()
+            except OSError:
+                pass
+
+
+def runWorker(address, authkey, genomes, evaluator, fn, profile=None, **overrides):
+    """ Conecta-se ao coordenador em 'address' e avalia os jobs recebidos
+    com fn(agent_id=slot, **argumentos) no 'evaluator' local, até receber
+    'stop', retornando o número de jobs recebidos. O genoma de cada job é copiado para o slot de 'genomes'
+    (SharedPopulation). 'overrides' substitui argumentos dos jobs
+    (ex.: render). Os totais do profiler 'profile' (profiler.sharedTotals
+    dos processos locais), se dados, são enviados com os resultados
+    """
+    conn = Client(address, authkey=authkey)
+    send_lock = threading.Lock()
+    slots = list(range(len(genomes.genomes)))
+    stopped = threading.Event()
+
+    def send(msg):
+        with send_lock:
+            conn.send(msg)
+
+    def done(future, job, slot):
+        # o episódio somou os seus tempos aos totais antes de terminar
+        totals = profiler.collect(profile).tolist() if profile is not None else None
+        try:
+            msg = ('result', job, future.result(), totals)
+        except BrokenExecutor:
+            # pool local quebrado: o worker sai e o coordenador reenvia os jobs
+            stopped.set()
+            return
+        except Exception:
+            msg = ('error', job, traceback.format_exc(), totals)
+        # o slot só é liberado depois do episódio, que lê os pesos dele
+        slots.append(slot)
+        try:
+            send(msg)
+        except (OSError, ValueError):
+            stopped.set()
+
+    def heartbeat():
+        while not stopped.wait(HEARTBEAT):
+            try:
+                send(('heartbeat', evaluator.report()))
+            except (OSError, ValueError):
+                stopped.set()
+
+    send(('hello', "{}:{}".format(socket.gethostname(), os.getpid()), len(slots)))
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    received = 0
+    try:
+        while not stopped.is_set():
+            try:
+                if not conn.poll(HEARTBEAT):
+                    continue
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if msg[0] == 'stop':
+                break
+
+            for job, genome, kwargs in msg[1]:
+                slot = slots.pop()
+                genomes.genomes[slot] = genome
+                kwargs.update(overrides)
+                try:
+                    future = evaluator.submit(fn, agent_id=slot, **kwargs)
+                except BrokenExecutor:
+                    stopped.set()
+                    break
+                future.add_done_callback(lambda f, job=job, slot=slot: done(f, job, slot))
+                received += 1
+    finally:
+        stopped.set()
+        conn.close()
+    return received
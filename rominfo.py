@@ -1,5 +1,4 @@
 import numpy as np
-from itertools import product
 
 sprites_ignore = [0x74, 0x78, 0x3E, 0x8E, 0x7B, 0x21]
 sprites_ground = [0x83, 0x84, 0xB9]
@@ -18,46 +17,16 @@ def getXY(ram):
     # Coordenadas x, y em relação a fase inteira 
     # Elas estão armazenadas em 2 bytes cada
     # no formato little endian
-    marioX = ram[0x95]*256 + ram[0x94]
-    marioY = ram[0x97]*256 + ram[0x96]
+    # (a RAM é uint8, por isso a conversão antes de multiplicar)
+    marioX = np.int64(ram[0x95])*256 + ram[0x94]
+    marioY = np.int64(ram[0x97])*256 + ram[0x96]
     
     # Coordenada da parte visível do site
-    layer1x = ram[0x1B]*256 + ram[0x1A]
-    layer1y = ram[0x1D]*256 + ram[0x1C]
+    layer1x = np.int64(ram[0x1B])*256 + ram[0x1A]
+    layer1y = np.int64(ram[0x1D])*256 + ram[0x1C]
     
     return marioX.astype(np.int16), marioY.astype(np.int16), layer1x.astype(np.int16), layer1y.astype(np.int16)
 
-def getSprites(ram):
-  '''
-  getSprites(ram): retorna os sprites (blocos, inimigos, itens) exibidos na tela.
-  '''
-  
-  sprites = []
-  
-  # Podem existir até 12 sprites na tela
-  for slot in range(12):
-    # se o status é 0, não tem sprite nesse slot
-    status = ram[0x14C8+slot]
-    if status != 0:
-      # posição x,y do sprite
-      spriteX    = ram[0xE4+slot] + ram[0x14E0+slot]*256
-      spriteY    = ram[0xD8+slot] + ram[0x14D4+slot]*256
-      
-      spriteSize = ram[0x0420+ram[0x15EA+slot]]  # tamanho do sprite
-      spriteId   = ram[0x15EA+slot]              # qual é o sprite?
-      spriteLabel = int(ram[0x9E + slot])  # https://smwspeedruns.com/Sprites
-      
-      # se for item (44) ou sprites ignoráveis, não insere
-      if spriteId != 44 and spriteLabel not in sprites_ignore:
-        # ou ele é 1x1 ou 4x4 blocos da nossa janela
-        size = 1
-        if spriteSize == 0:
-          size = 4
-        is_ground = spriteLabel in sprites_ground
-        sprites.append({'x': spriteX, 'y': spriteY, 'size': size, 'ground':is_ground})
-      
-  return sprites
-      
 def getTile(dx,dy,ram):
   '''
   getTile(dx, dy, ram): retorna se tem um bloco que o mario possa pisar na posição dx, dy
@@ -70,52 +39,99 @@ def getTile(dx,dy,ram):
   # return ram[0x1C800 + np.int(np.floor(x/16)*432 + y*16 + x%16)]
 
   # O endereço correto é 0x1F000, contribuição de Fernando Teixeira
-  return ram[0x1F000 + np.int(np.floor(x/16)*432 + y*16 + x%16)]
+  return ram[0x1F000 + int(np.floor(x/16)*432 + y*16 + x%16)]
   
+def getSpriteArrays(ram):
+  '''
+  getSpriteArrays(ram): retorna os sprites (blocos, inimigos, itens) exibidos na tela,
+  em arrays (x, y, tamanho, valor) com um elemento por sprite, na ordem dos slots.
+  Itens (44) e sprites ignoráveis não são incluídos.
+  O valor é 1 para sprites que servem de chão e -1 para inimigos.
+  '''
+  slots = np.arange(12)
+
+  status      = ram[0x14C8 + slots]
+  spriteId    = ram[0x15EA + slots]
+  spriteLabel = ram[0x9E + slots].astype(np.int64)
+  spriteSize  = ram[0x0420 + spriteId.astype(np.int64)]
+
+  keep = (status != 0) & (spriteId != 44) & ~np.isin(spriteLabel, sprites_ignore)
+
+  spriteX = ram[0xE4 + slots].astype(np.int64) + ram[0x14E0 + slots].astype(np.int64)*256
+  spriteY = ram[0xD8 + slots].astype(np.int64) + ram[0x14D4 + slots].astype(np.int64)*256
+  size    = np.where(spriteSize == 0, 4, 1)
+  value   = np.where(np.isin(spriteLabel, sprites_ground), 1, -1)
+
+  return spriteX[keep], spriteY[keep], size[keep], value[keep]
+
 def getInputs(ram, radius=6):
   '''
   getInputs(ram): retorna uma nd.array de inimigos, obstáculos dentro de um raio em torno do agente
+
+  Versão vetorizada do percurso célula a célula pela janela: o resultado
+  é idêntico, inclusive na ordem em que sprites e blocos se sobrepõem.
   '''
   
   marioX, marioY, layer1x, layer1y = getXY(ram)
-  sprites = getSprites(ram)
+  spriteX, spriteY, size, value = getSpriteArrays(ram)
 
   # tamanho do vetor
-  maxlen = (radius*2+1)*(radius*2+1)
+  side   = radius*2 + 1
+  maxlen = side*side
   inputs = np.zeros(maxlen, dtype=int)
   
-  # cada bloco de imagem representa 16x16 pixesl
-  # portanto tendo um x,y de referência do Mario
-  # devemos camihar de 16 em 16
-  window = (-radius*16, radius*16 + 1, 16)
-  j = 0
-
-  def withinLimits(idx, ds1, ds2, r, maxlen):
-    return (idx%(2*r + 1) + ds2 < 2*r + 1) and (idx + ds1*(2*r + 1) + ds2 < maxlen)
-  
-  for dy, dx in product(range(*window), repeat=2):
-    # verifica se tem obstáculo na posição x+dx, y+dy
-    # o +8 é para começar a medir a partir do meio do Mario
-    tile = getTile(marioX+dx+8, marioY+dy, ram)
-    
-    # O Mario está sempre no meio, 
-    # deve checar se o y está dentro do limite
-    if tile==1 and marioY+dy < 0x1B0:
-      inputs[j] = 1
-    
-    # Para cada sprite  
-    for i, sprite in enumerate(sprites):
-      # Se estiver dentro do bloco de 16 x 16 (-8, +8)
-      distx = np.abs(sprite['x'] - marioX - dx)
-      disty = np.abs(sprite['y'] - marioY - dy)
-      size = sprite['size']
-      if distx <= 8 and disty <= 8:
-        # se estiver dentro dos limites, insira -1
-        for s1, s2 in product(range(size), repeat=2):
-          if withinLimits(j, s1, s2, radius, maxlen):
-            # verifica se é 'chão' ou inimigo
-            inputs[j + s1*(radius*2 + 1) + s2] = 1 if sprite['ground'] else -1
-    j = j + 1
+  # deslocamentos (em pixels) de cada linha/coluna da janela em relação ao Mario
+  # cada bloco de imagem representa 16x16 pixels
+  offsets = np.arange(-radius, radius + 1)*16
+
+  # Blocos: um único acesso indexado à RAM para toda a janela
+  # o +8 é para começar a medir a partir do meio do Mario
+  wx = np.int64(marioX) + offsets + 8
+  wy = np.int64(marioY) + offsets
+  x = wx//16
+  y = wy//16
+  addr = 0x1F000 + (x//16)*432 + x%16 + y[:, None]*16
+  tiles = ram[addr]
+
+  # O Mario está sempre no meio, deve checar se o y está dentro do limite
+  solid = (tiles == 1) & (wy < 0x1B0)[:, None]
+
+  # Cada escrita em 'inputs' recebe uma chave de ordem igual à do laço
+  # original (célula de origem, depois sprite), para que a última escrita
+  # em cada célula seja a mesma. O bloco da célula k é escrito antes dos
+  # sprites encontrados na própria célula k.
+  cells = np.flatnonzero(solid)
+  targets = [cells]
+  values  = [np.ones(len(cells), dtype=int)]
+  keys    = [cells*16 - 1]
+
+  if len(spriteX) > 0:
+    # Sprite dentro do bloco de 16 x 16 (-8, +8) de cada linha/coluna
+    rows = np.abs(spriteY[:, None] - marioY - offsets[None, :]) <= 8
+    cols = np.abs(spriteX[:, None] - marioX - offsets[None, :]) <= 8
+    s, r, c = np.nonzero(rows[:, :, None] & cols[:, None, :])
+
+    # Expande cada ocorrência para os size x size blocos do sprite,
+    # descartando o que sai da janela
+    s1, s2 = np.divmod(np.arange(16), 4)
+    tr = r[:, None] + s1[None, :]
+    tc = c[:, None] + s2[None, :]
+    valid = (s1[None, :] < size[s][:, None]) & (s2[None, :] < size[s][:, None]) \
+          & (tr < side) & (tc < side)
+
+    targets.append((tr*side + tc)[valid])
+    values.append(np.broadcast_to(value[s][:, None], valid.shape)[valid])
+    keys.append(np.broadcast_to(((r*side + c)*16 + s)[:, None], valid.shape)[valid])
+
+  targets = np.concatenate(targets)
+  values  = np.concatenate(values)
+  keys    = np.concatenate(keys)
+
+  # Mantém apenas a última escrita de cada célula
+  order = np.argsort(keys, kind='stable')[::-1]
+  cells, first = np.unique(targets[order], return_index=True)
+  inputs[cells] = values[order][first]
+
   return inputs, marioX, marioY
 
 # Recupera o estado atual como um array bidimensional
@@ -127,8 +143,38 @@ def getState(ram, radius):
   
 
 def getRam(env):
-    ram = []
-    for k, v in env.data.memory.blocks.items():
-        ram += list(v)
-    return np.array(ram)
-    
\ No newline at end of file
+    '''
+    getRam(env): retorna uma cópia uint8 de todo o espaço de endereços.
+    No laço principal prefira RamView, que reaproveita o mesmo buffer.
+    '''
+    blocks = env.data.memory.blocks
+    return np.concatenate([np.frombuffer(v, dtype=np.uint8) for v in blocks.values()])
+
+
+class RamView:
+    '''
+    RamView(env): visão uint8 da RAM do emulador.
+    O layout dos blocos de memória (e o deslocamento de cada um no espaço
+    de endereços concatenado, o mesmo de getRam) é calculado uma única vez,
+    e a cada refresh() os blocos são copiados para o mesmo buffer
+    pré-alocado, sem listas Python nem arrays int64 intermediários.
+    '''
+    def __init__(self, env):
+        self.env = env
+
+        self.layout = []
+        start = 0
+        for k, v in env.data.memory.blocks.items():
+            self.layout.append((k, start, start + len(v)))
+            start += len(v)
+
+        self.ram = np.zeros(start, dtype=np.uint8)
+
+    def refresh(self):
+        """ Atualiza o buffer com o conteúdo atual da RAM e o retorna.
+        O array retornado é sempre o mesmo objeto.
+        """
+        blocks = self.env.data.memory.blocks
+        for k, start, end in self.layout:
+            self.ram[start:end] = np.frombuffer(blocks[k], dtype=np.uint8)
+        return self.ram
@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from utils import performAction, frameCount
+import pool
+
+'''
+Árvore de prefixos de ações com savestates.
+
+Filhos de uma mesma geração costumam jogar exatamente as mesmas ações que
+o pai durante boa parte da fase. Como o emulador é determinístico, tudo o
+que o laço de treinamento lê da RAM em cada decisão (state, posição e
+flags) depende apenas da sequência de ações desde o início do level.
+
+Cada nó da árvore guarda essa observação para uma decisão, e as arestas
+guardam a ação tomada e a recompensa obtida. Um novo agente percorre a
+árvore consultando apenas a sua rede neural, sem emular nada, até
+escolher uma ação ainda não jogada. Só então o emulador é levado até
+aquele nó, a partir do savestate mais profundo do caminho, e o episódio
+continua normalmente, acrescentando nós à árvore.
+
+Os savestates são guardados nos pontos de ramificação, limitados por um
+orçamento de memória (os menos usados recentemente são descartados).
+'''
+
+# Configuração (orçamento em bytes, número máximo de nós), definida por initWorker
+config = None
+
+# Árvore do processo atual, criada por getTree
+tree = None
+
+
+def initWorker(budget, max_nodes):
+    """ Initializer dos workers: ativa a árvore de prefixos no processo
+    """
+    global config
+    config = (budget, max_nodes)
+
+
+def getTree(level):
+    """ Retorna a árvore do processo para o level, ou None se desativada
+    """
+    global tree
+    if config is None:
+        return None
+    if tree is None or tree.level != level or tree.nodes > tree.max_nodes:
+        tree = SnapshotTree(level, *config)
+    return tree
+
+
+class Node:
+    __slots__ = ('obs', 'children', 'snapshot')
+
+    def __init__(self, obs):
+        # (state, x, y, bloco de mensagem, morte/fim da fase, fim da animação)
+        self.obs = obs
+        # ação -> (recompensa, nó filho)
+        self.children = {}
+        self.snapshot = None
+
+
+class SnapshotTree:
+    def __init__(self, level, budget, max_nodes):
+        self.level = level
+        self.budget = budget
+        self.max_nodes = max_nodes
+
+        self.root = None
+        self.nodes = 0
+
+        # nós com savestate, do menos para o mais recentemente usado
+        self.snapshots = OrderedDict()
+        self.used = 0
+
+    def add(self, parent, action, reward, obs):
+        """ Cria o nó alcançado a partir de 'parent' com 'action'
+        (ou a raiz, se 'parent' for None)
+        """
+        node = Node(obs)
+        self.nodes += 1
+        if parent is None:
+            self.root = node
+        else:
+            parent.children[action] = (reward, node)
+        return node
+
+    def restore(self, path):
+        """ Procura o savestate mais profundo em 'path' (lista de nós a
+        partir da raiz). Retorna (índice, savestate) ou (0, None) se não
+        houver nenhum, caso em que o episódio deve partir do início
+        """
+        for i in range(len(path) - 1, -1, -1):
+            snapshot = path[i].snapshot
+            if snapshot is not None:
+                self.snapshots.move_to_end(path[i])
+                return i, snapshot
+        return 0, None
+
+    def catchUp(self, env, nodes, actions, perform=performAction):
+        """ Leva o emulador até o último nó de 'nodes' (caminho a partir da
+        raiz), partindo do savestate mais profundo do caminho, ou do início
+        do level, e repetindo as ações gravadas ('actions') com 'perform'.
+        Retorna o número de frames emulados
+        """
+        start, snapshot = self.restore(nodes)
+        if snapshot is not None:
+            pool.restoreState(env, snapshot)
+
+        frames = 0
+        for node, action in zip(nodes[start:-1], actions[start:]):
+            # bloco de mensagem: pulo antes da ação (ver train_level)
+            if node.obs[3]:
+                perform(1, env)
+                frames += frameCount(1)
+            perform(action, env)
+            frames += frameCount(action)
+        return frames
+
+    def store(self, node, snapshot):
+        """ Guarda o savestate do nó, descartando os menos usados
+        recentemente caso o orçamento de memória seja excedido
+        """
+        if node.snapshot is not None or len(snapshot) > self.budget:
+            return
+        node.snapshot = snapshot
+        self.snapshots[node] = None
+        self.used += len(snapshot)
+
+        while self.used > self.budget:
+            old, _ = self.snapshots.popitem(last=False)
+            self.used -= len(old.snapshot)
+            old.snapshot = None
@@ -0,0 +1,141 @@
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+'''
+Transmissão de um episódio do treinamento para uma janela de espectador.
+
+Os workers não desenham a tela. O processo principal escolhe um agente
+(watch) e o worker que o avalia copia a tela reduzida para um buffer
+circular em memória compartilhada a cada decisão, sem nunca esperar. Um
+processo visualizador (view) exibe o frame mais recente no seu próprio
+ritmo; os frames que ele não chega a ler são sobrescritos e descartados.
+
+Layout do bloco: cabeçalho (int64), número de sequência de cada posição
+do buffer (int64) e os frames (uint8). O escritor zera o número de
+sequência antes de escrever um frame e o define depois; o leitor descarta
+a cópia se o número mudou durante a leitura (frame sobrescrito).
+'''
+
+# Tela do SNES e fator de redução
+SCREEN = (224, 256, 3)
+SCALE  = 2
+
+# Posições do buffer circular
+SLOTS = 8
+
+# Cabeçalho: frames escritos, agente transmitido (-1: nenhum), frames
+# exibidos e número de posições do buffer
+WRITTEN, TARGET, SHOWN, NSLOTS = range(4)
+HEADER = 4
+
+# Buffer do processo atual, definido por initWorker
+ring = None
+
+
+def initWorker(name):
+    """ Initializer dos workers: conecta o processo ao buffer do espectador
+    """
+    global ring
+    ring = SpectatorRing(name=name)
+
+
+def streaming(agent_id):
+    """ Se o episódio do agente 'agent_id' deve ser transmitido
+    """
+    return ring is not None and ring.header[TARGET] == agent_id
+
+
+class SpectatorRing:
+    def __init__(self, name=None, slots=SLOTS):
+        h, w, c = SCREEN
+        self.shape = (h // SCALE, w // SCALE, c)
+        frame_size = int(np.prod(self.shape))
+
+        if name is None:
+            size = 8 * (HEADER + slots) + slots * frame_size
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.header = np.ndarray(HEADER, dtype=np.int64, buffer=self.shm.buf)
+            self.header[NSLOTS] = slots
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.header = np.ndarray(HEADER, dtype=np.int64, buffer=self.shm.buf)
+            slots = int(self.header[NSLOTS])
+
+        self.slots = slots
+        self.seq = np.ndarray(slots, dtype=np.int64, buffer=self.shm.buf, offset=8*HEADER)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                                 offset=8*(HEADER + slots))
+
+        if name is None:
+            self.header[[WRITTEN, SHOWN]] = 0
+            self.header[TARGET] = -1
+            self.seq[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def watch(self, agent_id):
+        """ Define o agente a ser transmitido (-1: nenhum)
+        """
+        self.header[TARGET] = agent_id
+
+    def write(self, screen):
+        """ Escreve a tela reduzida na próxima posição do buffer
+        """
+        n = int(self.header[WRITTEN]) + 1
+        i = n % self.slots
+        small = screen[::SCALE, ::SCALE]
+        h, w = min(small.shape[0], self.shape[0]), min(small.shape[1], self.shape[1])
+
+        self.seq[i] = 0
+        self.frames[i, :h, :w] = small[:h, :w]
+        self.seq[i] = n
+        self.header[WRITTEN] = n
+
+    def latest(self, last=0):
+        """ Retorna (número, frame) do frame mais recente, se for mais novo
+        que 'last' e não tiver sido sobrescrito durante a cópia, ou None
+        """
+        n = int(self.header[WRITTEN])
+        if n <= last:
+            return None
+        i = n % self.slots
+        if self.seq[i] != n:
+            return None
+        frame = self.frames[i].copy()
+        if self.seq[i] != n:
+            return None
+        return n, frame
+
+    def close(self, unlink=False):
+        self.header = self.seq = self.frames = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def view(name, fps=30):
+    """ Processo visualizador: exibe o frame mais recente do buffer 'name'
+    até a janela ser fechada
+    """
+    from retro.rendering import SimpleImageViewer
+
+    ring = SpectatorRing(name=name)
+    viewer = SimpleImageViewer()
+    last = 0
+    try:
+        while True:
+            start = time.monotonic()
+            frame = ring.latest(last)
+            if frame is not None:
+                last, image = frame
+                viewer.imshow(image)
+                ring.header[SHOWN] += 1
+                if not viewer.isopen:
+                    break
+            time.sleep(max(1/fps - (time.monotonic() - start), 0))
+    finally:
+        viewer.close()
+        ring.close()
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+
+'''
+Biblioteca de inícios no meio do level.
+
+Conforme a população melhora, a maior parte dos frames emulados é gasta
+repetindo o trecho inicial do level, que quase todos os agentes já
+atravessam. Os episódios que partem do início do level anotam a posição
+e o frame em que passam de cada 'step' pixels além do checkpoint mais
+distante da biblioteca. O episódio que foi mais longe é jogado de novo
+até o último desses frames, guardando os savestates, que são
+acrescentados à biblioteca (os savestates dos demais episódios nunca
+são criados nem enviados pelo pool). Em cada geração, uma fração da
+população é avaliada a partir de um checkpoint sorteado, com a
+distância (e os pontos e frames) contada a partir dele.
+
+A biblioteca de cada level é salva em um .npz (sem pickle): a posição x
+de cada checkpoint e os savestates concatenados.
+'''
+
+# Fração padrão da população avaliada a partir de um checkpoint
+MIX = 0.5
+
+# Checkpoints capturados no máximo por episódio
+MAX_CAPTURES = 4
+
+
+class StartLibrary:
+    def __init__(self, level, step):
+        self.level = level
+        self.step = step
+        self.xs = []        # posição x de cada checkpoint, em ordem crescente
+        self.snapshots = [] # savestate de cada checkpoint
+
+    def __len__(self):
+        return len(self.xs)
+
+    def frontier(self):
+        """ Posição do checkpoint mais distante (0: nenhum)
+        """
+        return self.xs[-1] if self.xs else 0
+
+    def capture(self):
+        """ Argumento 'capture' de train_level: (distância do próximo
+        checkpoint, intervalo entre checkpoints)
+        """
+        return (self.frontier() + self.step, self.step)
+
+    def add(self, starts):
+        """ Acrescenta os savestates (x, savestate) capturados em um
+        episódio que estão além da fronteira. Retorna quantos foram
+        acrescentados
+        """
+        added = 0
+        for x, snapshot in sorted(starts, key=lambda s: s[0]):
+            if x >= self.frontier() + self.step:
+                self.xs.append(int(x))
+                self.snapshots.append(snapshot)
+                added += 1
+        return added
+
+    def choose(self, n, mix=MIX):
+        """ Checkpoint de cada um de n agentes (-1: início do level). Uma
+        fração 'mix' dos agentes, sorteada, recebe um checkpoint sorteado
+        """
+        chosen = np.full(n, -1)
+        if self.xs and mix > 0:
+            k = int(round(n * mix))
+            who = np.random.choice(n, k, replace=False)
+            chosen[who] = np.random.randint(len(self.xs), size=k)
+        return chosen
+
+    def save(self, filename):
+        data = b''.join(self.snapshots)
+        offsets = np.cumsum([0] + [len(s) for s in self.snapshots])
+        tmp = filename + '.tmp.npz'
+        np.savez(tmp, level=self.level, step=self.step, xs=np.array(self.xs, dtype=np.int64),
+                 offsets=offsets, data=np.frombuffer(data, dtype=np.uint8))
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def load(filename, level, step):
+        """ Carrega a biblioteca salva em 'filename', ou cria uma vazia se
+        ele não existir ou for de outro level ou intervalo
+        """
+        library = StartLibrary(level, step)
+        if not os.path.isfile(filename):
+            return library
+        with np.load(filename) as data:
+            if str(data['level']) != level or int(data['step']) != step:
+                return library
+            raw = data['data'].tobytes()
+            offsets = data['offsets']
+            library.xs = [int(x) for x in data['xs']]
+            library.snapshots = [raw[lo:hi] for lo, hi in zip(offsets, offsets[1:])]
+        return library
@@ -0,0 +1,176 @@
+import numpy as np
+from utils import dec2bin, actions_list
+from rominfo import getRam, getState
+
+'''
+Emulador simulado para medir o laço de treinamento sem a ROM nem o retro.
+
+O StubEnv reproduz, em ciclo, uma sequência de RAMs gravadas de um
+emulador real (ver record), independente das ações recebidas. A cada
+'stride' frames emulados a RAM avança para a próxima gravação.
+Quando não há gravação disponível, synthetic() gera uma sequência de RAMs
+plausível (Mario andando para a direita, blocos e sprites), útil apenas
+para medir o custo do código Python.
+'''
+
+# Tamanho da RAM do Super Mario World no retro (bloco único em 0x7E0000)
+RAM_ADDRESS = 0x7E0000
+RAM_SIZE    = 0x20000
+
+
+class StubMemory:
+    def __init__(self, env):
+        self.env = env
+
+    @property
+    def blocks(self):
+        ram = self.env.fixture.frames[self.env.index()]
+        return {k: ram[start:end].tobytes() for k, start, end in self.env.fixture.layout}
+
+
+class StubData:
+    def __init__(self, env):
+        self.memory = StubMemory(env)
+
+    def reset(self):
+        pass
+
+    def update_ram(self):
+        pass
+
+    def current_reward(self, player=0):
+        return 0.0
+
+    def is_done(self):
+        return False
+
+
+class StubEmulator:
+    def __init__(self, env):
+        self.env = env
+
+    def step(self):
+        self.env.frame += 1
+
+    def set_button_mask(self, mask, player=0):
+        pass
+
+    def get_state(self):
+        return int(self.env.frame).to_bytes(8, 'little')
+
+    def set_state(self, state):
+        self.env.frame = int.from_bytes(state, 'little')
+
+
+class StubEnv:
+    """ Interface mínima de um env do retro usada por train.py e play.py
+    """
+    def __init__(self, fixture):
+        self.fixture = fixture
+        self.frame = 0
+        self.mode = 'fast'
+        self.data = StubData(self)
+        self.em = StubEmulator(self)
+
+    def index(self):
+        return (self.frame // self.fixture.stride) % len(self.fixture.frames)
+
+    def reset(self):
+        self.frame = 0
+
+    def step(self, a):
+        self.em.step()
+        return None, 0.0, False, {}
+
+    def action_to_array(self, a):
+        return [np.array([int(b) for b in a], dtype=np.uint8)]
+
+    def render(self, close=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class Fixture:
+    """ Sequência de RAMs (frames x bytes) e layout dos blocos de memória
+    """
+    def __init__(self, frames, layout, stride):
+        self.frames = frames
+        self.layout = layout
+        self.stride = stride
+
+    @staticmethod
+    def load(filename):
+        with np.load(filename) as data:
+            keys, sizes = data['keys'], data['sizes']
+            starts = np.concatenate([[0], np.cumsum(sizes)])
+            layout = [(int(k), int(s), int(e)) for k, s, e in zip(keys, starts, starts[1:])]
+            return Fixture(data['frames'], layout, int(data['stride']))
+
+    def save(self, filename):
+        keys = [k for k, start, end in self.layout]
+        sizes = [end - start for k, start, end in self.layout]
+        np.savez_compressed(filename, frames=self.frames, keys=keys, sizes=sizes, stride=self.stride)
+
+
+def synthetic(count=256, stride=4, seed=0):
+    """ Gera uma Fixture sintética com 'count' RAMs
+    """
+    rng = np.random.RandomState(seed)
+    frames = np.zeros((count, RAM_SIZE), dtype=np.uint8)
+
+    # mapa de colisão: chão e alguns blocos soltos
+    frames[:, 0x1C800:] = rng.rand(RAM_SIZE - 0x1C800) < 0.15
+
+    for i in range(count):
+        ram = frames[i]
+        x, y = 16 + 6*i, 0x140
+        ram[0x94], ram[0x95] = x % 256, x // 256
+        ram[0x96], ram[0x97] = y % 256, y // 256
+
+        # alguns sprites ao redor do Mario
+        for slot in range(rng.randint(0, 6)):
+            sx, sy = x + rng.randint(-96, 96), y + rng.randint(-96, 96)
+            ram[0x14C8 + slot] = 8
+            ram[0xE4 + slot], ram[0x14E0 + slot] = sx % 256, sx // 256
+            ram[0xD8 + slot], ram[0x14D4 + slot] = sy % 256, sy // 256
+            ram[0x15EA + slot] = rng.randint(0, 44)
+            ram[0x9E + slot] = rng.choice([0x0F, 0x10, 0x83, 0x74])
+
+    return Fixture(frames, [(RAM_ADDRESS, 0, RAM_SIZE)], stride)
+
+
+def record(agent, level, count=256, stride=4):
+    """ Grava uma Fixture jogando o level com 'agent' em um emulador real:
+    uma RAM a cada 'stride' frames, mantendo cada ação por 'stride' frames
+    """
+    import retro
+
+    env = retro.make(game='SuperMarioWorld-Snes', state=level, players=1)
+    env.mode = 'fast'
+    try:
+        env.reset()
+        layout = []
+        start = 0
+        for k, v in env.data.memory.blocks.items():
+            layout.append((k, start, start + len(v)))
+            start += len(v)
+
+        frames = []
+        while len(frames) < count:
+            ram = getRam(env)
+            frames.append(ram)
+
+            state, x, y = getState(ram, 6)
+            action = actions_list[np.argmax(agent.brain.predict([state]))]
+            for it in range(stride):
+                env.step(dec2bin(action))
+
+            # ram[0x0DDA] = 0xff indica que o agente morreu ou concluiu a fase
+            if ram[0x0DDA] == 0xff:
+                env.reset()
+    finally:
+        env.close()
+
+    return Fixture(np.stack(frames), layout, stride)
@@ -0,0 +1,299 @@
+import os
+import sys
+import csv
+import time
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import wait, FIRST_COMPLETED
+
+'''
+Varredura de hiperparâmetros em um único pool de avaliação.
+
+Cada combinação dos valores dados na linha de comando (ex.: popsize=20,50
+hidden=32,64) é um trial: uma população independente, com os seus
+próprios genomas compartilhados, topologia e raio do state. Os episódios
+de todos os trials são enviados ao mesmo EvaluationPool, com no máximo
+--inflight episódios por processo em andamento; o próximo episódio é
+sempre do trial que menos frames consumiu até agora (divisão justa do
+pool entre os trials). Cada episódio leva os nomes dos genomas dos trials
+em andamento, e os workers fecham os demais que tinham aberto.
+
+Cada trial tem um orçamento de gerações (-g) e de frames (--frames) e é
+interrompido antes se o melhor score não melhorar por --patience gerações,
+ou se, a partir da geração --grace, ficar abaixo da mediana dos trials
+na mesma geração. O melhor score por geração e o tempo de cada trial são
+salvos em "sweeps/[nome].csv", e o resumo em "sweeps/[nome]_summary.csv".
+'''
+
+parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+parser.add_argument("grid"              , nargs='*', metavar='param=v1,v2', help="valores de cada hiperparâmetro: popsize, alpha, mut_rate, hidden, radius")
+parser.add_argument("-n", "--numproc"   , type=int  , metavar='', help="numero de processos", default=1)
+parser.add_argument("-l", "--level"     , type=str  , metavar='', help="fase", default='YoshiIsland2')
+parser.add_argument("-g", "--generations", type=int , metavar='', help="gerações por trial", default=20)
+parser.add_argument("-f", "--frames"    , type=int  , metavar='', help="frames por trial (0: sem limite)", default=0)
+parser.add_argument("--patience"        , type=int  , metavar='', help="gerações sem melhora para interromper um trial (0 desativa)", default=5)
+parser.add_argument("--grace"           , type=int  , metavar='', help="gerações antes de interromper trials abaixo da mediana (0 desativa)", default=3)
+parser.add_argument("--inflight"        , type=int  , metavar='', help="episódios em andamento por processo", default=2)
+parser.add_argument("-c", "--cache"     , type=int  , metavar='', help="entradas do cache de avaliações (0 desativa)", default=10000)
+parser.add_argument("--headless"        , help="emuladores sem observações de tela", action="store_true")
+parser.add_argument("-o", "--output"    , type=str  , metavar='', help="nome dos resultados em 'sweeps/'", default='sweep')
+parser.add_argument("--seed"            , type=int  , metavar='', help="semente do numpy", default=None)
+
+args = parser.parse_args()
+
+# train.py lê a linha de comando ao ser importado
+argv, sys.argv = sys.argv, sys.argv[:1]
+import train
+import pool
+import population
+from pool import EvaluationPool
+from agent import Agent
+from cache import FitnessCache
+from population import SharedPopulation
+sys.argv = argv
+
+# Hiperparâmetros aceitos e seus valores padrão (os de train.py)
+DEFAULTS = {
+    'popsize':  train.args.popsize,
+    'alpha':    train.ALPHA,
+    'mut_rate': train.MUT_RATE,
+    'hidden':   train.topology[1],
+    'radius':   train.radius,
+}
+TYPES = {'popsize': int, 'alpha': float, 'mut_rate': float, 'hidden': int, 'radius': int}
+
+# Situação de cada trial
+RUNNING, DONE, BUDGET, STALLED, BELOW_MEDIAN = 'rodando', 'concluído', 'orçamento', 'sem melhora', 'abaixo da mediana'
+
+
+def parseGrid(specs):
+    """ ['popsize=20,50', 'alpha=0.1'] -> lista de dicionários, um por
+    combinação dos valores
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in DEFAULTS or not values:
+            raise SystemExit("hiperparâmetro inválido: '{}' (use {}=v1,v2,...)".format(spec, '|'.join(DEFAULTS)))
+        grid[name] = [TYPES[name](v) for v in values.split(',')]
+
+    names = list(grid)
+    trials = []
+    for values in itertools.product(*(grid[n] for n in names)):
+        params = dict(DEFAULTS)
+        params.update(zip(names, values))
+        trials.append(params)
+    return trials
+
+
+class Trial:
+    def __init__(self, number, params, level):
+        self.number = number
+        self.params = params
+        self.level = level
+
+        self.radius = params['radius']
+        side = 2*self.radius + 1
+        self.topology = [side*side, params['hidden'], train.output_size]
+        self.genomes = SharedPopulation(self.topology, params['popsize'])
+        self.settings = repr((train.evalSettings(level), self.radius, self.topology))
+
+        self.agents = [Agent(self.topology) for i in range(params['popsize'])]
+        self.generation = 0
+        self.status = RUNNING
+        self.history = [] # melhor score de cada geração
+        self.frames = 0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+        self.newGeneration()
+
+    def newGeneration(self):
+        self.genomes.load(self.agents)
+        self.pending = list(range(len(self.agents)))
+        self.running = 0
+        self.results = 0
+
+    def best(self):
+        return max(self.history) if self.history else 0.0
+
+    def finish(self, i, result):
+        """ Registra o resultado do agente i. Retorna True se a geração terminou
+        """
+        self.agents[i].setResult(result)
+        self.frames += result.frames
+        self.results += 1
+        return self.results == len(self.agents)
+
+    def close(self):
+        self.elapsed = time.perf_counter() - self.start
+        self.genomes.close(unlink=True)
+
+    def describe(self):
+        return ' '.join('{}={}'.format(k, v) for k, v in self.params.items())
+
+
+def episode(live, **kwargs):
+    """ Job dos workers: fecha os genomas que o processo abriu e que não
+    estão em 'live' (os dos trials em andamento), e joga o episódio com
+    train_level
+    """
+    population.retain(live)
+    return train.train_level(**kwargs)
+
+
+def stopReason(trial, trials):
+    """ Motivo para encerrar o trial após a sua geração atual, ou None
+    """
+    if trial.generation >= args.generations:
+        return DONE
+    if args.frames > 0 and trial.frames >= args.frames:
+        return BUDGET
+
+    history = trial.history
+    if args.patience > 0 and len(history) > args.patience and \
+            max(history[-args.patience:]) <= max(history[:-args.patience]):
+        return STALLED
+
+    # Regra da mediana: compara com os trials que chegaram a esta geração
+    g = trial.generation
+    if args.grace > 0 and g >= args.grace:
+        others = [max(t.history[:g]) for t in trials if len(t.history) >= g]
+        if len(others) > 2 and max(history) < np.median(others):
+            return BELOW_MEDIAN
+    return None
+
+
+def run(trials, evaluator, processes, cache, log):
+    """ Executa os trials até todos terminarem, retornando o tempo gasto
+    """
+    futures = {} # future -> (trial, agente, chave do cache)
+    start = time.perf_counter()
+
+    def endGeneration(trial):
+        best = max(trial.agents)
+        trial.history.append(best.score)
+        trial.generation += 1
+        elapsed = time.perf_counter() - trial.start
+        log.writerow([trial.number] + list(trial.params.values()) +
+                     [trial.generation, round(best.score, 2), int(best.max_x),
+                      round(float(np.mean([a.score for a in trial.agents])), 2), trial.frames, round(elapsed, 2)])
+
+        reason = stopReason(trial, trials)
+        if reason is not None:
+            trial.status = reason
+            trial.close()
+            print("Trial {} ({}): {} na geração {} | melhor score {:,.1f} | {:,} frames | {:.1f}s".format(
+                trial.number, trial.describe(), reason, trial.generation, trial.best(), trial.frames, trial.elapsed))
+            return
+
+        trial.agents.sort(reverse=True)
+        trial.agents = train.offspring(trial.agents, trial.params['alpha'], trial.params['mut_rate'])
+        trial.newGeneration()
+
+    def submitNext():
+        """ Envia um episódio do trial que menos frames consumiu. Retorna
+        False se nenhum trial tem episódios a enviar
+        """
+        while True:
+            ready = [t for t in trials if t.status == RUNNING and t.pending]
+            if not ready:
+                return False
+            trial = min(ready, key=lambda t: t.frames)
+            i = trial.pending.pop()
+
+            key = None
+            if cache is not None:
+                key = FitnessCache.key(trial.genomes.genomes[i], trial.settings)
+                result = cache.get(key)
+                if result is not None:
+                    if trial.finish(i, result):
+                        endGeneration(trial)
+                    continue
+
+            # os workers fecham os genomas dos trials que não estão mais em andamento
+            live = tuple(t.genomes.spec()[2] for t in trials if t.status == RUNNING)
+            future = evaluator.submit(episode, live, agent_id=i, render=False, level=trial.level,
+                                      genomes=trial.genomes.spec(), radius=trial.radius)
+            futures[future] = (trial, i, key)
+            trial.running += 1
+            return True
+
+    while True:
+        while len(futures) < processes * args.inflight and submitNext():
+            pass
+        if not futures:
+            break
+
+        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            trial, i, key = futures.pop(future)
+            result = future.result()
+            trial.running -= 1
+            if cache is not None:
+                cache.put(key, result)
+            if trial.finish(i, result):
+                endGeneration(trial)
+
+    return time.perf_counter() - start
+
+
+def printSummary(trials, elapsed, filename):
+    """ Imprime e salva a tabela de resultados, do melhor para o pior trial
+    """
+    names = list(DEFAULTS)
+    ranked = sorted(trials, key=lambda t: -t.best())
+    header = ['trial'] + names + ['gerações', 'melhor score', 'frames', 'tempo (s)', 'situação']
+    rows = [[t.number] + [t.params[n] for n in names] +
+            [t.generation, round(t.best(), 2), t.frames, round(t.elapsed, 2), t.status] for t in ranked]
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    print()
+    print(("{:>5} " + "{:>9} "*len(names) + "{:>9} {:>12} {:>12} {:>10}  {}").format(*header))
+    for row in rows:
+        print(("{:>5} " + "{:>9} "*len(names) + "{:>9} {:>12,.1f} {:>12,} {:>10.1f}  {}").format(*row))
+    print("Varredura: {} trials em {:.1f}s | resultados em '{}'".format(len(trials), elapsed, filename))
+
+
+def main():
+    if args.seed is not None:
+        np.random.seed(args.seed)
+
+    params = parseGrid(args.grid)
+    processes = min(os.cpu_count() - 2, args.numproc)
+    print("Varredura: {} trials em {} processos".format(len(params), processes))
+
+    initializers = []
+    if args.headless:
+        initializers.append((pool.initHeadless, ()))
+    evaluator = EvaluationPool(processes, initializers)
+    cache = FitnessCache(args.cache) if args.cache > 0 else None
+
+    os.makedirs('sweeps', exist_ok=True)
+    log_file = os.path.join('sweeps', args.output + '.csv')
+    summary_file = os.path.join('sweeps', args.output + '_summary.csv')
+
+    trials = [Trial(i, p, args.level) for i, p in enumerate(params)]
+    try:
+        with open(log_file, 'w', newline='') as f:
+            log = csv.writer(f)
+            log.writerow(['trial'] + list(DEFAULTS) + ['geração', 'melhor score', 'melhor distância',
+                                                       'score médio', 'frames', 'tempo (s)'])
+            elapsed = run(trials, evaluator, processes, cache, log)
+        evaluator.close()
+        printSummary(trials, elapsed, summary_file)
+    finally:
+        evaluator.kill()
+        for trial in trials:
+            if trial.status == RUNNING:
+                trial.close()
+
+
+if __name__ == "__main__":
+    main()
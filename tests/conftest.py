@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Os módulos do projeto ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# train.py lê a linha de comando ao ser importado
+sys.argv = sys.argv[:1]
@@ -0,0 +1,105 @@
+import numpy as np
+import train
+import pool
+import inference
+import population
+from nn import FrozenNetwork
+from agent import Agent, Result
+from population import SharedPopulation
+from inference import InferenceServer, InferenceClient
+from stub import StubEnv, synthetic
+
+'''
+Episódios de train_level no emulador simulado com a rede congelada local
+(float32) e com as decisões do servidor central de inferência (-i, em
+lote, float64). Cada caminho é comparado com NeuralNetwork.predict nos
+states em que decidiu: as saídas devem ser próximas, e a ação deve ser a
+de maior saída sempre que as duas maiores não estiverem empatadas dentro
+da precisão do float32.
+'''
+
+POPSIZE = 4
+
+# Tolerância das saídas (sigmoid) em relação a NeuralNetwork.predict
+TOLERANCE = 100 * np.finfo(np.float32).eps
+
+
+def play(genomes, monkeypatch, server=None):
+    """ Joga um episódio de cada agente dos genomas no processo atual, com
+    o StubEnv como emulador. Retorna os Results e as decisões
+    (agente, state, ação) de todos os episódios
+    """
+    decisions = []
+    current = [0] # agente do episódio em andamento
+    if server is None:
+        act = FrozenNetwork.act
+        def recording(net, state):
+            action = act(net, state)
+            decisions.append((current[0], np.array(state), action))
+            return action
+        monkeypatch.setattr(FrozenNetwork, 'act', recording)
+    else:
+        inference.initWorker(*server.clientArgs())
+        predict = InferenceClient.predict
+        def recording(client, agent_id, state):
+            action = predict(client, agent_id, state)
+            decisions.append((agent_id, np.array(state), action))
+            return action
+        monkeypatch.setattr(InferenceClient, 'predict', recording)
+
+    population.shared = genomes
+    pool.env, pool.env_level = StubEnv(synthetic(count=128)), 'stub'
+    try:
+        results = []
+        for i in range(len(genomes)):
+            current[0] = i
+            results.append(train.train_level(i, False, 'stub', record=True))
+        return results, decisions
+    finally:
+        inference.client = None
+        population.shared = None
+        pool.env = pool.env_level = None
+
+
+def check(genomes, decisions, outputs):
+    """ Compara as saídas 'outputs' (uma linha por decisão) e as ações
+    com as de NeuralNetwork.predict
+    """
+    ids = np.array([i for i, state, action in decisions])
+    states = np.array([state for i, state, action in decisions], dtype=np.float64)
+    actions = np.array([action for i, state, action in decisions])
+    reference = np.concatenate([genomes.brain(i).predict([state]) for i, state in zip(ids, states)])
+
+    assert np.allclose(outputs, reference, rtol=0, atol=TOLERANCE)
+
+    top = np.sort(reference, axis=1)
+    clear = top[:, -1] - top[:, -2] > 2 * TOLERANCE
+    assert clear.mean() > 0.9
+    assert (actions[clear] == reference[clear].argmax(axis=1)).all()
+
+
+def test_inference_matches_predict(monkeypatch):
+    np.random.seed(3)
+    genomes = SharedPopulation(train.topology, POPSIZE)
+    genomes.load([Agent(train.topology) for i in range(POPSIZE)])
+    server = InferenceServer(train.input_size, 1, genomes)
+    try:
+        local, local_decisions = play(genomes, monkeypatch)
+        remote, remote_decisions = play(genomes, monkeypatch, server)
+        requests, batches = server.report()
+
+        frozen = [genomes.brain(i).freeze() for i in range(POPSIZE)]
+        check(genomes, local_decisions,
+              np.concatenate([frozen[i].predict(state) for i, state, action in local_decisions]))
+        check(genomes, remote_decisions,
+              inference.forward(inference.stackedWeights(genomes),
+                                np.array([i for i, state, action in remote_decisions]),
+                                np.array([state for i, state, action in remote_decisions], dtype=np.float64)))
+    finally:
+        server.close()
+        genomes.close(unlink=True)
+
+    assert all(isinstance(r, Result) for r in local + remote)
+    # cada decisão fora de blocos de mensagem passou pelo servidor
+    assert requests == len(remote_decisions) == sum(len(r.trace) for r in remote) + len(remote)
+    assert len({r.trace for r in local}) > 1
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+import train
+import pool
+import snapshots
+import population
+from concurrent.futures import Future
+from agent import Agent, Paused, END_RACE
+from population import SharedPopulation
+from stub import StubEnv, synthetic
+
+'''
+Avaliação por corrida (-r): um episódio pausado ao atingir o orçamento e
+continuado a partir de Paused.state deve terminar com o mesmo Result que
+o jogado de uma só vez, e os agentes eliminados terminam com END_RACE,
+mantendo a duração do último episódio completo.
+'''
+
+POPSIZE = 8
+
+
+class InlineEvaluator:
+    """ Executa cada job no próprio processo, ao ser enviado
+    """
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+@pytest.fixture
+def genomes():
+    np.random.seed(5)
+    genomes = SharedPopulation(train.topology, POPSIZE)
+    genomes.load([Agent(train.topology) for i in range(POPSIZE)])
+    fixture = synthetic(count=96)
+    fixture.frames[20:24, 0x1426] = 1
+    population.shared = genomes
+    pool.env, pool.env_level = StubEnv(fixture), 'stub'
+    yield genomes
+    snapshots.config = snapshots.tree = None
+    population.shared = None
+    pool.env = pool.env_level = None
+    genomes.close(unlink=True)
+
+
+@pytest.mark.parametrize('tree', [False, True])
+def test_resumed_episode_matches_full_run(genomes, tree):
+    if tree:
+        snapshots.initWorker(2**20, train.SNAPSHOT_NODES)
+    for i in range(POPSIZE):
+        full = train.train_level(i, False, 'stub', record=True)
+
+        budget, pauses, emulated = 30, 0, 0
+        result = train.train_level(i, False, 'stub', budget=budget, record=True)
+        while isinstance(result, Paused):
+            pauses += 1
+            emulated += result.result.emulated
+            assert result.result.frames >= budget
+            budget *= train.RACE_GROWTH
+            result = train.train_level(i, False, 'stub', budget=budget, resume=result.state, record=True)
+
+        assert pauses > 0
+        assert result._replace(emulated=full.emulated) == full
+        if not tree:
+            assert emulated + result.emulated == full.frames
+
+
+def test_race_culls_with_partial_result(genomes, monkeypatch):
+    results = {}
+    setResult = Agent.setResult
+    def recording(agent, result):
+        results[id(agent)] = result
+        setResult(agent, result)
+    monkeypatch.setattr(Agent, 'setResult', recording)
+
+    agents = [Agent(train.topology, genomes.brain(i)) for i in range(POPSIZE)]
+    previous = [1000 + 10*i for i in range(POPSIZE)]
+    for agent, frames in zip(agents, previous):
+        agent.frames = frames
+    full = [train.train_level(i, False, 'stub') for i in range(POPSIZE)]
+
+    completed = train.train(agents, 1, InlineEvaluator(), genomes, False, 'stub', race=30)
+
+    assert sorted(map(id, completed)) == sorted(map(id, agents))
+    culled = [i for i, a in enumerate(agents) if results[id(a)].reason == END_RACE]
+    assert 0 < len(culled) < POPSIZE
+    for i, agent in enumerate(agents):
+        if i in culled:
+            # resultado parcial, com a duração prevista do último episódio completo
+            assert results[id(agent)].frames < full[i].frames
+            assert agent.frames == previous[i]
+        else:
+            assert results[id(agent)]._replace(emulated=full[i].emulated) == full[i]
+            assert agent.frames == full[i].frames
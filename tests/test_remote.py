@@ -0,0 +1,164 @@
+import os
+import time
+import signal
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client
+import remote
+import profiler
+from pool import COSTS
+from remote import RemotePool
+from population import Population
+
+'''
+Coordenador (RemotePool) e workers (runWorker) em processos locais,
+conectados por localhost. Os jobs apenas devolvem o seu argumento e o
+primeiro peso do genoma recebido, depois de 'delay' segundos.
+'''
+
+AUTHKEY = b'teste'
+TOPOLOGY = [1, 1]
+JOBS = 8
+
+# os workers herdam os intervalos reduzidos de HEARTBEAT e TIMEOUT
+context = mp.get_context('fork')
+
+
+class ThreadEvaluator:
+    """ Pool de avaliação do worker com threads, com a interface usada
+    por runWorker
+    """
+    def __init__(self, threads):
+        self.executor = ThreadPoolExecutor(threads)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def report(self):
+        return dict.fromkeys(COSTS, 0.0)
+
+
+def serveJobs(address, slots, delay, profile=False):
+    """ Processo worker com 'slots' jobs em andamento no máximo. Com
+    'profile', cada job conta um episódio no profiler
+    """
+    genomes = Population(TOPOLOGY, np.zeros((slots, 2)))
+    totals = None
+    if profile:
+        totals = profiler.sharedTotals()
+        profiler.initWorker(totals)
+
+    def job(agent_id, tag):
+        prof = profiler.start()
+        time.sleep(delay)
+        prof.lap(profiler.EMULATOR)
+        prof.finish(10)
+        return tag, float(genomes.genomes[agent_id][0])
+
+    remote.runWorker(address, AUTHKEY, genomes, ThreadEvaluator(slots), job, profile=totals)
+
+
+def startWorker(address, slots, delay, profile=False):
+    process = context.Process(target=serveJobs, args=(address, slots, delay, profile), daemon=True)
+    process.start()
+    return process
+
+
+def waitFor(condition, timeout=10.0):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "tempo esgotado"
+        time.sleep(0.01)
+
+
+def coordinator(monkeypatch):
+    monkeypatch.setattr(remote, 'HEARTBEAT', 0.1)
+    monkeypatch.setattr(remote, 'TIMEOUT', 0.5)
+    genomes = Population(TOPOLOGY, np.arange(2*JOBS, dtype=np.float64).reshape(JOBS, 2))
+    return RemotePool(('localhost', 0), AUTHKEY, genomes)
+
+
+def expected():
+    return [(i, float(2*i)) for i in range(JOBS)]
+
+
+def test_lost_worker_jobs_are_requeued(monkeypatch):
+    evaluator = coordinator(monkeypatch)
+    address = evaluator.listener.address
+    processes = [startWorker(address, 2, 0.3) for i in range(2)]
+    try:
+        futures = [evaluator.submit(None, i, tag=i) for i in range(JOBS)]
+        waitFor(lambda: len(evaluator.workers) == 2)
+
+        # mata um worker com jobs em andamento
+        with evaluator.lock:
+            busy = [w for w in evaluator.workers.values() if w.running]
+            pid = int(busy[0].name.rsplit(':', 1)[1])
+        os.kill(pid, signal.SIGKILL)
+
+        assert [f.result(timeout=10) for f in futures] == expected()
+        stats = evaluator.summary()
+        assert stats['perdidos'] == 1
+        assert stats['reenviados'] >= 1
+        assert stats['workers'] == 1
+        # workers sem o profiler não enviam os tempos
+        assert evaluator.collectProfile() is None
+    finally:
+        evaluator.kill()
+        for process in processes:
+            process.join(5)
+            process.kill()
+
+
+def test_heartbeat_timeout_and_batching(monkeypatch):
+    evaluator = coordinator(monkeypatch)
+    address = evaluator.listener.address
+    futures = [evaluator.submit(None, i, tag=i) for i in range(JOBS)]
+
+    # worker que recebe um lote de jobs e depois não envia mais nada
+    frozen = Client(address, authkey=AUTHKEY)
+    process = None
+    try:
+        frozen.send(('hello', 'congelado', 4))
+        kind, batch = frozen.recv()
+        assert kind == 'jobs'
+        assert [job for job, genome, kwargs in batch] == [0, 1, 2, 3]
+        assert [float(genome[0]) for job, genome, kwargs in batch] == [0.0, 2.0, 4.0, 6.0]
+
+        # descartado por TIMEOUT, os seus jobs voltam para a fila. Os jobs
+        # do novo worker demoram mais que TIMEOUT: só os heartbeats o mantêm
+        waitFor(lambda: not evaluator.workers)
+        process = startWorker(address, 3, 0.8)
+
+        assert [f.result(timeout=10) for f in futures] == expected()
+        stats = evaluator.summary()
+        assert stats['perdidos'] == 1
+        assert stats['reenviados'] == 4
+        assert stats['jobs'] == JOBS + 4
+        assert stats['lotes'] < stats['jobs']
+    finally:
+        frozen.close()
+        evaluator.kill()
+        if process is not None:
+            process.join(5)
+            process.kill()
+
+
+def test_profile_totals_reach_coordinator(monkeypatch):
+    evaluator = coordinator(monkeypatch)
+    address = evaluator.listener.address
+    process = startWorker(address, 2, 0.05, profile=True)
+    try:
+        futures = [evaluator.submit(None, i, tag=i) for i in range(JOBS)]
+        assert [f.result(timeout=10) for f in futures] == expected()
+
+        # os tempos de cada job chegam com o seu resultado
+        totals = evaluator.collectProfile()
+        assert totals[len(profiler.PHASES) + profiler.EPISODES] == JOBS
+        assert totals[len(profiler.PHASES) + profiler.FRAMES] == 10*JOBS
+        assert totals[profiler.EMULATOR] >= 0.05*JOBS
+    finally:
+        evaluator.kill()
+        process.join(5)
+        process.kill()
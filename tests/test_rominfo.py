@@ -0,0 +1,101 @@
+import numpy as np
+from itertools import product
+from rominfo import getXY, getTile, getInputs, getState, sprites_ignore, sprites_ground
+from stub import synthetic, RAM_SIZE
+
+'''
+Paridade entre o getInputs vetorizado e o percurso célula a célula
+original pela janela, em RAMs da fixture sintética e em RAMs aleatórias
+(sprites de tamanhos variados sobrepondo blocos e uns aos outros).
+'''
+
+
+def loopSprites(ram):
+    """ Sprites da RAM como no getSprites original
+    """
+    sprites = []
+    for slot in range(12):
+        if ram[0x14C8+slot] != 0:
+            spriteX = int(ram[0xE4+slot]) + int(ram[0x14E0+slot])*256
+            spriteY = int(ram[0xD8+slot]) + int(ram[0x14D4+slot])*256
+            spriteSize = ram[0x0420+int(ram[0x15EA+slot])]
+            spriteId = ram[0x15EA+slot]
+            spriteLabel = int(ram[0x9E+slot])
+            if spriteId != 44 and spriteLabel not in sprites_ignore:
+                size = 4 if spriteSize == 0 else 1
+                sprites.append({'x': spriteX, 'y': spriteY, 'size': size, 'ground': spriteLabel in sprites_ground})
+    return sprites
+
+
+def loopInputs(ram, radius):
+    """ getInputs original: percorre a janela célula a célula
+    """
+    marioX, marioY, layer1x, layer1y = getXY(ram)
+    sprites = loopSprites(ram)
+
+    maxlen = (radius*2+1)*(radius*2+1)
+    inputs = np.zeros(maxlen, dtype=int)
+    window = (-radius*16, radius*16 + 1, 16)
+    j = 0
+
+    def withinLimits(idx, ds1, ds2, r, maxlen):
+        return (idx%(2*r + 1) + ds2 < 2*r + 1) and (idx + ds1*(2*r + 1) + ds2 < maxlen)
+
+    for dy, dx in product(range(*window), repeat=2):
+        tile = getTile(marioX+dx+8, marioY+dy, ram)
+        if tile == 1 and marioY+dy < 0x1B0:
+            inputs[j] = 1
+
+        for sprite in sprites:
+            distx = np.abs(sprite['x'] - marioX - dx)
+            disty = np.abs(sprite['y'] - marioY - dy)
+            if distx <= 8 and disty <= 8:
+                for s1, s2 in product(range(sprite['size']), repeat=2):
+                    if withinLimits(j, s1, s2, radius, maxlen):
+                        inputs[j + s1*(radius*2 + 1) + s2] = 1 if sprite['ground'] else -1
+        j = j + 1
+    return inputs, marioX, marioY
+
+
+def randomRams(count, seed=1):
+    """ RAMs com o Mario em posições aleatórias e sprites agrupados ao redor
+    dele, de tamanhos 1 e 4, do chão ou inimigos
+    """
+    rng = np.random.RandomState(seed)
+    rams = []
+    for i in range(count):
+        ram = np.zeros(RAM_SIZE, dtype=np.uint8)
+        ram[0x1F000:] = rng.rand(RAM_SIZE - 0x1F000) < 0.3
+        ram[0x0420:0x0420+256] = rng.randint(0, 2, 256)
+        x, y = rng.randint(0, 0x800), rng.randint(0, 0x1C0)
+        ram[0x94], ram[0x95] = x % 256, x // 256
+        ram[0x96], ram[0x97] = y % 256, y // 256
+        for slot in range(12):
+            sx, sy = max(x + rng.randint(-120, 120), 0), max(y + rng.randint(-120, 120), 0)
+            ram[0x14C8 + slot] = rng.randint(0, 3)
+            ram[0xE4 + slot], ram[0x14E0 + slot] = sx % 256, sx // 256
+            ram[0xD8 + slot], ram[0x14D4 + slot] = sy % 256, sy // 256
+            ram[0x15EA + slot] = rng.randint(0, 48)
+            ram[0x9E + slot] = rng.choice(sprites_ignore[:2] + sprites_ground + [0x0F, 0x10])
+        rams.append(ram)
+    return rams
+
+
+def assertParity(rams, radius):
+    for k, ram in enumerate(rams):
+        expected, ex, ey = loopInputs(ram, radius)
+        for state, x, y in (getInputs(ram, radius), getState(ram, radius)):
+            assert (x, y) == (ex, ey)
+            np.testing.assert_array_equal(state, expected, err_msg="RAM {} (raio {})".format(k, radius))
+
+
+def test_synthetic_fixture():
+    frames = synthetic(count=64).frames
+    for radius in (3, 6):
+        assertParity(frames, radius)
+
+
+def test_random_rams():
+    rams = randomRams(100)
+    for radius in (2, 6):
+        assertParity(rams, radius)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+import train
+import pool
+import snapshots
+import population
+from agent import Agent
+from population import Population, SharedPopulation
+from snapshots import SnapshotTree
+from stub import StubEnv, synthetic
+
+'''
+Episódios de train_level com a árvore de prefixos de ações devem ter o
+mesmo Result que os jogados do início do level, inclusive quando o
+orçamento de savestates ou o limite de nós força descartes.
+'''
+
+POPSIZE = 12
+
+
+class RewardEnv(StubEnv):
+    """ StubEnv com uma recompensa que depende do frame, para que os
+    pontos de cada episódio dependam das ações jogadas
+    """
+    def step(self, a):
+        self.em.step()
+        return None, float(self.frame % 7), False, {}
+
+
+def family():
+    """ Genomas de filhos mutados de poucos pais, que jogam as mesmas
+    ações durante parte do episódio
+    """
+    np.random.seed(8)
+    parents = Population.fromAgents([Agent(train.topology) for i in range(3)])
+    children = parents.take(np.arange(POPSIZE) % 3)
+    children.mutation(prob=0.02)
+    genomes = SharedPopulation(train.topology, POPSIZE)
+    genomes.genomes[:] = children.genomes
+    return genomes
+
+
+def play(genomes, config=None):
+    """ Joga, no processo atual, um episódio de cada agente (duas vezes,
+    para percorrer a árvore já construída), com a árvore de prefixos
+    configurada com 'config' (orçamento, nós) ou desativada
+    """
+    if config is not None:
+        snapshots.initWorker(*config)
+    fixture = synthetic(count=96)
+    # blocos de mensagem: o pulo também é repetido ao alcançar um nó
+    fixture.frames[20:24, 0x1426] = 1
+    population.shared = genomes
+    pool.env, pool.env_level = RewardEnv(fixture), 'stub'
+    try:
+        return [train.train_level(i, False, 'stub', record=True) for i in list(range(POPSIZE))*2]
+    finally:
+        snapshots.config = snapshots.tree = None
+        population.shared = None
+        pool.env = pool.env_level = None
+
+
+@pytest.mark.parametrize('config', [(2**20, 200000), (16, 200000), (16, 300)])
+def test_tree_matches_rollout(config, monkeypatch):
+    stored = []
+    store = SnapshotTree.store
+    def counting(tree, node, snapshot):
+        stored.append(node)
+        store(tree, node, snapshot)
+        assert tree.used <= tree.budget
+    monkeypatch.setattr(SnapshotTree, 'store', counting)
+
+    genomes = family()
+    try:
+        rollout = play(genomes)
+        tree = play(genomes, config)
+    finally:
+        genomes.close(unlink=True)
+
+    for a, b in zip(rollout, tree):
+        assert (a.points, a.max_x, a.frames, a.reason, a.trace) == (b.points, b.max_x, b.frames, b.reason, b.trace)
+    assert all(r.emulated == r.frames for r in rollout)
+    # parte dos frames foi reaproveitada da árvore
+    assert sum(r.emulated for r in tree) < sum(r.frames for r in rollout)
+    if config[0] == 16:
+        # savestates de 8 bytes: no máximo 2 guardados, os demais descartados
+        assert len(stored) > 2
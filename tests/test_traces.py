@@ -0,0 +1,36 @@
+import train
+import pool
+import traces
+import population
+from agent import Agent, END_LEVEL
+from population import SharedPopulation
+from stub import StubEnv, synthetic
+
+'''
+O trace gravado por train_level deve reproduzir exatamente os frames do
+Result, inclusive quando o episódio termina em um bloco de mensagem.
+'''
+
+
+def test_trace_frames_end_on_message_block():
+    fixture = synthetic(count=64)
+    # blocos de mensagem no meio do episódio e, no fim, a fase concluída
+    # em uma decisão em que o agente está em um bloco de mensagem
+    fixture.frames[10:14, 0x1426] = 1
+    fixture.frames[30:, 0x1426] = 1
+    fixture.frames[30:, 0x0DDA] = 0xff
+
+    genomes = SharedPopulation(train.topology, 1)
+    genomes.load([Agent(train.topology)])
+    population.shared = genomes
+    pool.env, pool.env_level = StubEnv(fixture), 'stub'
+    try:
+        result = train.train_level(0, False, 'stub', record=True)
+    finally:
+        population.shared = None
+        pool.env = pool.env_level = None
+        genomes.close(unlink=True)
+
+    assert result.reason == END_LEVEL
+    assert traces.MESSAGE in result.trace
+    assert traces.traceFrames(result.trace) == result.frames
@@ -0,0 +1,78 @@
+import numpy as np
+from collections import namedtuple
+from utils import performAction, frameCount, actions_list
+from rominfo import RamView, getXY
+
+'''
+Gravação compacta das decisões de um episódio e reprodução sem a rede.
+
+O emulador é determinístico, então a sequência de ações a partir do início
+do level basta para reproduzir um episódio. Cada decisão é guardada em um
+byte: o índice da ação em 'actions_list', ou MESSAGE quando o agente estava
+em um bloco de mensagem (pulo seguido da ação 0, ver train_level).
+'''
+
+# Decisão em um bloco de mensagem
+MESSAGE = 0xFF
+
+# Episódio gravado: level, lista de ações usada na gravação, decisões e resultado
+Trace = namedtuple('Trace', ['level', 'actions', 'decisions', 'points', 'max_x', 'frames'])
+
+
+def decisionActions(code, actions=actions_list):
+    """ Ações executadas em uma decisão gravada
+    """
+    if code == MESSAGE:
+        return (1, 0)
+    return (actions[code],)
+
+
+def traceFrames(decisions, actions=actions_list):
+    """ Número de frames do episódio gravado
+    """
+    return sum(frameCount(a) for code in decisions for a in decisionActions(code, actions))
+
+
+def save(filename, level, decisions, points, max_x, frames):
+    np.savez(filename, level=level, actions=np.array(actions_list),
+             decisions=np.frombuffer(bytes(decisions), dtype=np.uint8),
+             result=np.array([points, max_x, frames], dtype=np.float64))
+
+
+def load(filename):
+    with np.load(filename) as data:
+        points, max_x, frames = data['result']
+        return Trace(str(data['level']), [int(a) for a in data['actions']], data['decisions'].tobytes(),
+                     float(points), int(max_x), int(frames))
+
+
+def replay(env, trace, perform=performAction, render=False, track=False):
+    """ Reproduz as decisões gravadas no emulador 'env', já resetado no
+    início do level, executando cada ação com 'perform'. Se 'track' for
+    dado, a posição do agente é lida da RAM a cada decisão.
+    Retorna (pontos, frames, max_x); max_x é 0 sem 'track'
+    """
+    ram_view = RamView(env) if track else None
+    points = 0
+    frames = 0
+    max_x = 0
+
+    for code in trace.decisions:
+        if track:
+            x, y, layer1x, layer1y = getXY(ram_view.refresh())
+            max_x = max(max_x, int(x))
+
+        for a in decisionActions(code, trace.actions):
+            reward, done, info = perform(a, env)
+            frames += frameCount(a)
+        # como em train_level, o pulo no bloco de mensagem não soma pontos
+        points += reward
+
+        if render:
+            env.render()
+
+    if track:
+        x, y, layer1x, layer1y = getXY(ram_view.refresh())
+        max_x = max(max_x, int(x))
+
+    return points, frames, max_x
@@ -1,14 +1,36 @@
 import os
 import sys
-import retro
+import time
+import random
+import secrets
 import argparse
+import multiprocessing as mp
 import numpy as np
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import as_completed
 from nn import *
 from utils import *
 from rominfo import *
-from agent import Agent
+from agent import *
+import population
+from population import Population, SharedPopulation
+import inference
+from inference import InferenceServer
+from cache import FitnessCache
+import pool
+import snapshots
+import profiler
+import checkpoint
+import traces
+import spectator
+import starts
+from starts import StartLibrary
+from metrics import MetricsLog
+from checkpoint import CheckpointWriter
+from pool import EvaluationPool
+import remote
+from remote import RemotePool
+from spectator import SpectatorRing
 
 # argparser - Recebe argumentos por linha de comando
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -21,6 +43,27 @@ parser.add_argument("-n", "--numproc"     , type=int, metavar='',  help="numero
 parser.add_argument("-g", "--generations" , type=int , metavar='', help="numero de gerações"   , default=0)
 parser.add_argument("-l", "--level"       , type=str , metavar='', help="fase"                 , default='YoshiIsland2')
 parser.add_argument("-p", "--popsize"     , type=int , metavar='', help="tamanho da população" , default=50)
+parser.add_argument("-i", "--inference"   , help="usar servidor central de inferência em lote", action="store_true")
+parser.add_argument("-c", "--cache"       , type=int , metavar='', help="entradas do cache de avaliações (0 desativa)", default=10000)
+parser.add_argument("--disk-cache"        , help="manter o cache de avaliações em 'agents/'", action="store_true")
+parser.add_argument("-r", "--race"        , type=int , metavar='', help="frames da primeira rodada da avaliação por corrida (0 desativa)", default=0)
+parser.add_argument("--headless"          , help="emuladores sem observações de tela e passos sem criar observações (ignorado com a tela visível)", action="store_true")
+parser.add_argument("--snapshots"         , type=int , metavar='', help="MB por worker para savestates da árvore de prefixos de ações (0 desativa)", default=0)
+parser.add_argument("--sparse"            , type=float, metavar='', help="densidade máxima do state para o primeiro layer esparso (0 desativa, ver benchmark.py --density)", default=0.0)
+parser.add_argument("--starts"            , type=int , metavar='', help="pixels entre os checkpoints de início no meio do level (0 desativa)", default=0)
+parser.add_argument("--start-mix"         , type=float, metavar='', help="fração da população avaliada a partir de um checkpoint", default=starts.MIX)
+parser.add_argument("--traces"            , help="gravar as decisões de cada episódio e as do melhor agente em 'agents/'", action="store_true")
+parser.add_argument("--spectate"          , type=str , metavar='', help="sem tela nos workers: transmite para uma janela os episódios do filho do melhor agente ('best') ou de um agente sorteado ('random')", default=None, choices=['best', 'random'])
+parser.add_argument("--schedule-log"      , help="gravar a duração prevista e a real de cada episódio em 'agents/'", action="store_true")
+parser.add_argument("--steady"            , type=int , metavar='', help="evolução em regime permanente com esse número de episódios simultâneos (0 desativa)", default=0)
+parser.add_argument("--listen"            , type=int , metavar='', help="coordenador: porta TCP em que os workers se conectam (0 desativa)", default=0)
+parser.add_argument("--host"              , type=str , metavar='', help="coordenador: endereço em que --listen aguarda os workers (ex.: 0.0.0.0 para todas as interfaces)", default='localhost')
+parser.add_argument("--worker"            , type=str , metavar='', help="worker: avalia episódios do coordenador em host:porta", default=None)
+parser.add_argument("--authkey"           , type=str , metavar='', help="chave compartilhada entre coordenador e workers (obrigatória com --worker; sem ela, o coordenador gera e exibe uma)", default=None)
+parser.add_argument("--checkpoint"        , type=int , metavar='', help="gerações entre checkpoints da população inteira (0 desativa)", default=1)
+parser.add_argument("--resume"            , help="retomar do checkpoint da população inteira em vez de carregar o agente salvo", action="store_true")
+parser.add_argument("--profile"           , help="medir o tempo de cada fase dos episódios", action="store_true")
+parser.add_argument("--pstats"            , type=str , metavar='', help="pasta para um arquivo do cProfile por worker (implica --profile)", default=None)
 
 args = parser.parse_args()
 
@@ -35,6 +78,17 @@ max_score =  6000 # não deve passar disso
 
 ALPHA = 0.2 # Constante que influencia desvio padrão da mutação
 
+# Se a posição do agente seja ultrapassada pela dead line, ele morre
+DEAD_LINE       = -300
+DEAD_LINE_SPEED = 5
+
+# Número máximo de nós da árvore de prefixos de ações (por worker)
+SNAPSHOT_NODES = 200000
+
+# Avaliação por corrida: fração eliminada por rodada e crescimento do orçamento
+RACE_CULL   = 0.5
+RACE_GROWTH = 2
+
 
 
 def populate(training_file, topology, popsize):
@@ -46,13 +100,13 @@ def populate(training_file, topology, popsize):
         loaded = Agent.load(training_file)
         best_ever = loaded
 
-        agents = [loaded.copy() for i in range(popsize)]
+        clones = Population.fromAgents([loaded]).take(np.zeros(popsize, dtype=int))
         
         temperature = (1 - loaded.fitness)
         stdDev = max(temperature * ALPHA, 0.01)
 
-        for agent in agents:
-            agent.mutate(prob=MUT_RATE, stdDev=stdDev)
+        clones.mutation(prob=MUT_RATE, stdDev=stdDev)
+        agents = [loaded.copy(clones.brain(i)) for i in range(popsize)]
     else:
         agents = [Agent(topology=topology) for i in range(popsize)]
 
@@ -60,90 +114,489 @@ def populate(training_file, topology, popsize):
 
 
 
-def train(agents, generation, processes, render, level):
-    """ Cria um processo para cada agente. O numero de processos simultâneos
-    é limitado pela entrada 'processes'
+def resume(checkpoint_file, popsize):
+    """ Retoma o treinamento de um checkpoint da população inteira.
+    Retorna os agentes e a geração do checkpoint
+    """
+    global best_ever
+    start = time.perf_counter()
+    saved = checkpoint.load(checkpoint_file)
+    agents, best_ever = checkpoint.restore(saved, topology)
+
+    # Se o tamanho da população mudou, agentes são descartados ou clonados
+    if len(agents) != popsize:
+        agents = [agents[i] if i < len(agents) else agents[i % len(agents)].copy()
+                  for i in range(popsize)]
+
+    print("Checkpoint: geração {} retomada de '{}' em {:.3f}s".format(
+        saved.generation, checkpoint_file, time.perf_counter() - start))
+    return agents, saved.generation
+
+
+
+def evalSettings(level):
+    """ Configurações que, junto com os pesos, determinam o resultado de
+    um episódio (parte da chave do cache de avaliações). Inclui a
+    inferência: o servidor central (-i) decide em float64, e a rede
+    congelada em float32, com o primeiro layer esparso até --sparse
+    """
+    decisions = ('servidor', 'float64') if args.inference else ('local', 'float32', args.sparse)
+    return repr((level, radius, topology, actions_list, STOP_TIME, DEAD_LINE, DEAD_LINE_SPEED, decisions))
+
+
+
+def predictFrames(agents):
+    """ Duração prevista (em frames) do episódio de cada agente: a duração
+    do último episódio do pai. Agentes sem essa informação (ex.: população
+    inicial) usam uma regressão linear da duração sobre a distância (max_x)
+    dos demais, ou apenas a distância, se nenhuma duração for conhecida
+    """
+    frames = np.array([getattr(a, 'frames', 0) for a in agents], dtype=np.float64)
+    max_x = np.array([a.max_x for a in agents], dtype=np.float64)
+
+    known = frames > 0
+    if known.all():
+        return frames
+    if known.sum() < 2 or np.ptp(max_x[known]) == 0:
+        return np.where(known, frames, max_x)
+
+    slope, intercept = np.polyfit(max_x[known], frames[known], 1)
+    return np.where(known, frames, np.maximum(intercept + slope * max_x, 0))
+
+
+
+def train(agents, generation, evaluator, genomes, render, level, cache=None, race=None, schedule_log=None,
+          library=None, stats=None):
+    """ Avalia cada agente em um dos processos do pool 'evaluator'.
+    Os pesos são copiados para os genomas compartilhados 'genomes', e cada
+    worker recebe apenas o índice do agente, devolvendo um Result.
+    Os episódios são enviados do mais longo para o mais curto, segundo
+    predictFrames (escalonamento LPT), para que os mais longos não
+    fiquem para o fim da geração. A duração prevista e a real de cada
+    episódio são anexadas ao CSV 'schedule_log', se dado.
+    Agentes cujo genoma está no 'cache' não são avaliados novamente, e
+    genomas repetidos na geração são avaliados uma única vez.
+    Se 'race' for dado, a avaliação é feita em rodadas (successive halving):
+    todos jogam até 'race' frames, os piores episódios pausados são
+    encerrados com a pontuação parcial, e os demais continuam de onde
+    pararam, com um orçamento RACE_GROWTH vezes maior a cada rodada.
+    Com a biblioteca de inícios 'library', parte dos agentes começa em um
+    checkpoint no meio do level, com o resultado relativo a ele e o score
+    na escala dos que começaram no início do level (ver comparable), e os
+    checkpoints do episódio que foi mais longe são acrescentados a ela
+    (ver recapture).
+    Os frames da geração (total e emulados) são guardados em 'stats', se dado
     """
     popsize = len(agents)
     completed = []
-    with ProcessPoolExecutor(max_workers=processes) as executor:
-            try:
-                futures = [executor.submit(train_level, agent=agent, render=render, level=level)
-                        for agent in agents]
-                
-                print("Generation: {0:}".format(generation))
-                pbar = tqdm(total=popsize, colour="green") # barra de progresso
-                for future in as_completed(futures):
-                    completed.append(future.result())
-                    pbar.update(1)
-                pbar.close()
-
-            finally:
-                for process in executor._processes.values():
-                    process.kill()
+    genomes.load(agents)
+
+    print("Generation: {0:}".format(generation))
+    pbar = tqdm(total=popsize, colour="green") # barra de progresso
+    start = time.perf_counter()
+    frames = 0
+    emulated = 0
+    reasons = [0, 0, 0, 0]
+    culled = [] # (frames jogados, duração do último episódio completo) de cada eliminado na corrida
+
+    # Duração do último episódio completo de cada agente (a do pai, ver predictFrames)
+    previous = [getattr(a, 'frames', 0) for a in agents]
+
+    def finish(agent, result):
+        nonlocal frames
+        agent.setResult(relative(result, agent.start))
+        completed.append(agent)
+        frames += result.frames
+        reasons[result.reason] += 1
+        pbar.update(1)
+
+    settings = evalSettings(level)
+    captured = [] # (max_x, checkpoints, agente) dos episódios com checkpoints capturados
+    chosen = library.choose(popsize, args.start_mix) if library is not None else np.full(popsize, -1)
+    for agent, c in zip(agents, chosen):
+        agent.start = library.xs[c] if c >= 0 else 0
+
+    futures = {} # future -> (chave, agentes com esse genoma)
+    pending = {} # chave -> future
+    predicted = predictFrames(agents)
+    schedule = [] # (agente, duração prevista, duração real)
+
+    # Espectador: o filho do melhor agente ou um agente sorteado (com o
+    # 'random' do Python, para não alterar a sequência do numpy)
+    if spectator.ring is not None:
+        if args.spectate == 'best':
+            spectator.ring.watch(int(np.argmax([a.score for a in agents])))
+        else:
+            spectator.ring.watch(random.randrange(len(agents)))
+    for i in np.argsort(-predicted, kind='stable'):
+        agent = agents[i]
+        key = None
+        if cache is not None:
+            key = FitnessCache.key(genomes.genomes[i], settings + repr(agent.start))
+            result = cache.get(key, args.traces)
+            if result is not None:
+                finish(agent, result)
+                continue
+            if key in pending:
+                futures[pending[key]][1].append(agent)
+                continue
+
+        start_state = startState(library, chosen[i], args.traces) if chosen[i] >= 0 else None
+        capture = library.capture() if library is not None and chosen[i] < 0 else None
+        future = evaluator.submit(train_level, agent_id=i, render=render, level=level, budget=race,
+                                  resume=start_state, record=args.traces, capture=capture)
+        futures[future] = (key, [agent], i)
+        pending[key] = future
+
+    budget = race
+    while futures:
+        paused = []
+        for future in as_completed(futures):
+            result = future.result()
+            key, same, i = futures[future]
+            if isinstance(result, Paused):
+                emulated += result.result.emulated
+                same[0].setResult(relative(result.result, same[0].start))
+                paused.append((result, key, same, i))
+                continue
+
+            if cache is not None:
+                cache.put(key, result._replace(starts=None))
+
+            emulated += result.emulated
+            schedule.append((i, predicted[i], result.frames))
+            if result.starts is not None:
+                captured.append((result.max_x, result.starts, i))
+            for agent in same:
+                finish(agent, result)
+
+        # Corrida: os piores episódios pausados são encerrados com a
+        # pontuação parcial, os demais continuam com um orçamento maior
+        order = np.argsort(comparable([p[2][0] for p in paused]), kind='stable')
+        paused = [paused[k] for k in order]
+        cut = int(len(paused) * RACE_CULL) if len(paused) > 1 else 0
+        for result, key, same, i in paused[:cut]:
+            culled.append((result.result.frames, previous[i]))
+            if result.result.starts is not None:
+                captured.append((result.result.max_x, result.result.starts, i))
+            for agent in same:
+                finish(agent, result.result._replace(reason=END_RACE))
+                # o episódio não foi jogado até o fim: a duração prevista
+                # para os filhos continua sendo a do último episódio completo
+                agent.frames = previous[i]
+
+        if paused:
+            budget *= RACE_GROWTH
+        survivors = sorted(paused[cut:], key=lambda p: -predicted[p[3]])
+        futures = {evaluator.submit(train_level, agent_id=i, render=render, level=level,
+                                    budget=budget, resume=result.state, record=args.traces): (key, same, i)
+                   for result, key, same, i in survivors}
+    pbar.close()
+
+    # Savestates dos checkpoints do episódio que foi mais longe
+    added = recaptured = 0
+    if library is not None:
+        added, recaptured = recapture(library, evaluator, captured, level)
+        emulated += recaptured
+
+    elapsed = time.perf_counter() - start
+    if stats is not None:
+        stats.update(frames=frames, emulated=emulated)
+
+    # Com a biblioteca de inícios, a seleção usa scores comparáveis entre
+    # os agentes que começaram em checkpoints diferentes
+    if library is not None:
+        for agent, score in zip(completed, comparable(completed)):
+            agent.score = score
+
+    print("Frames: {:,} emulados de {:,} ({:.1%}), {:,.0f} frames/s | Término: parado {} | dead line {} | morte/fim da fase {} | corrida {}".format(
+        emulated, frames, emulated/max(frames, 1), emulated/elapsed, *reasons))
+
+    if len(schedule) > 1:
+        ids, expected, actual = np.array(schedule).T
+        error = np.abs(expected - actual).sum() / max(actual.sum(), 1)
+        corr = np.corrcoef(expected, actual)[0, 1] if np.ptp(expected) > 0 and np.ptp(actual) > 0 else 0
+        if expected.any():
+            print("Escalonamento: {:.2f}s | duração prevista x real: correlação {:.2f}, erro {:.1%}".format(
+                elapsed, corr, error))
+        else:
+            print("Escalonamento: {:.2f}s | sem duração prevista".format(elapsed))
+        if schedule_log is not None:
+            new = not os.path.isfile(schedule_log)
+            with open(schedule_log, 'a') as f:
+                if new:
+                    f.write("generation,agent,predicted,frames\n")
+                for i, p, a in schedule:
+                    f.write("{},{},{:.0f},{}\n".format(generation, int(i), p, a))
+
+    if culled:
+        # Linha de base: cada eliminado jogaria tanto quanto o seu último
+        # episódio completo. Eliminados sem essa duração (ex.: população
+        # inicial) não entram na conta
+        known = [(f, p) for f, p in culled if p > 0]
+        saved = sum(max(p - f, 0) for f, p in known)
+        print("Corrida: {} eliminados | ~{:,.0f} frames economizados em relação à duração do último episódio completo ({} eliminados com duração conhecida)".format(
+            len(culled), saved, len(known)))
+
+    if library is not None:
+        print("Inícios: {} agentes a partir de checkpoints | biblioteca: {} checkpoints até x = {:,} (+{}, {:,} frames recapturados)".format(
+            int((chosen >= 0).sum()), len(library), library.frontier(), added, recaptured))
+
+    if cache is not None:
+        hits, total = cache.report()
+        print("Cache: {}/{} acertos ({:.1%}) | {:,} entradas".format(
+            hits, total, hits/max(total, 1), len(cache.entries)))
+        cache.save()
+
     return completed
 
 
 
-def train_level(agent, render, level):
-    """ Treina o agente. O treinamento é interrompido quando o agente
-    vence o level, morre, ou fica parado sem ter progresso por muito tempo.
-    Após o término do treinamento, o score do agente é calculado e ele
-    é retornado.
+def train_level(agent_id, render, level, budget=None, resume=None, record=False, capture=None,
+                savestates=False, genomes=None, radius=radius):
+    """ Treina o agente 'agent_id' dos genomas compartilhados. O treinamento
+    é interrompido quando o agente vence o level, morre, ou fica parado sem
+    ter progresso por muito tempo. Retorna o Result do episódio.
+    Com a árvore de prefixos ativa, as decisões que já foram jogadas por
+    outros agentes são percorridas sem emular (ver snapshots.py).
+    Se o episódio atingir 'budget' frames, ele é pausado e é retornado um
+    Paused, cujo 'state' pode ser passado em 'resume' para continuá-lo.
+    Com 'record', as decisões são gravadas no 'trace' do Result.
+    Com 'capture' (distância, intervalo), é guardado um checkpoint
+    (posição x, frame, savestate) ao passar da distância e depois a cada
+    intervalo, nos 'starts' do Result. O savestate só é guardado com
+    'savestates', que desativa a árvore de prefixos (ver recapture).
+    'genomes' e 'radius' permitem avaliar agentes de outra população,
+    com outra topologia e outro raio do state (ver sweep.py): 'genomes' é
+    o spec() de uma SharedPopulation.
     """
+    shared = population.shared if genomes is None else population.attach(*genomes)
+    agent = Agent(shared.shape, shared.brain(agent_id))
+    net = agent.brain.freeze(args.sparse) if inference.client is None else None
 
-    env = retro.make(game='SuperMarioWorld-Snes',
-                     state=level, players=1)
-    env.mode = 'fast'
+    # Emulador do processo, mantido entre episódios e gerações
+    env = pool.getEnv(level)
+    tree = snapshots.getTree(level) if not savestates else None
 
-    # Se a posição do agente seja ultrapassada pela dead line, ele morre
-    dead_line = -300
-    dead_line_speed = 5
+    # Sem tela, os frames podem ser emulados sem criar observações
+    perform = performActionFast if pool.headless and not render else performAction
+
+    dead_line = DEAD_LINE
 
     points = 0
+    frames = 0
+    emulated = 0
+    trace = bytearray() if record else None
+    captured = []
+
+    if resume is not None:
+        # Continua um episódio pausado (ou começa em um checkpoint da
+        # biblioteca de inícios), sem a árvore de prefixos
+        snapshot, progress, dead_line, points, frames, trace, capture, captured = resume
+        pool.restoreState(env, snapshot)
+        agent.setProgress(progress)
+        tree = None
+
+    # Nó da decisão atual e caminho (nós e ações) desde a raiz da árvore
+    node = tree.root if tree is not None else None
+    path, taken = [], []
+    live = node is None
+    action = reward = None
+
+    # Tempo de cada fase do laço (apenas com --profile)
+    prof = profiler.start()
     
     try:
-        env.reset()
+        ram_view = RamView(env)
 
         while True:
-            ram = getRam(env)
-            state, x, y = getState(ram, radius)
+            if budget is not None and frames >= budget:
+                if not live:
+                    emulated += tree.catchUp(env, path + [node], taken, perform)
+                state = (env.em.get_state(), agent.progress(), dead_line, points, frames, trace, capture, captured)
+                prof.lap(profiler.EMULATOR)
+                prof.finish(emulated)
+                return Paused(Result(float(points), int(agent.max_x), frames, None, emulated,
+                                     None, captured or None), state)
+
+            # Checkpoint para a biblioteca de inícios
+            if capture is not None and agent.curr_pos.x >= capture[0] and len(captured) < starts.MAX_CAPTURES:
+                x = int(agent.curr_pos.x)
+                captured.append((x, frames, env.em.get_state() if savestates else None))
+                capture = (x + capture[1], capture[1])
+
+            prof.count(profiler.DECISIONS)
+            if live:
+                ram = ram_view.refresh()
+                prof.lap(profiler.RAM)
+                prof.sprites(ram)
+                state, x, y = getState(ram, radius)
+                prof.lap(profiler.STATE)
+                # ram[0x1426] != 0 indica que o agente bateu em um bloco de mensagem
+                # ram[0x0DDA] = 0xff indica que o agente morreu ou concluiu a fase
+                # ram[0x1493] = 0x00 indica que a animação de término da fase já acabou
+                obs = (state.astype(np.int8), x, y, ram[0x1426] != 0, ram[0x0DDA] == 0xff, ram[0x1493] == 0x00)
+                if tree is not None:
+                    node = tree.add(node, action, reward, obs)
+            else:
+                obs = node.obs
+
+            state, x, y, message, level_over, animation_over = obs
             # printState(state, radius)
             agent.setPos(x, y)
             
-            nn_input = [state]
-            prediction = agent.brain.predict(nn_input)
-            act_idx = np.argmax(prediction)
-            action = actions_list[act_idx]
-
-            # Agente bate em bloco de mensagem
-            if ram[0x1426] != 0:
-                performAction(1, env)
+            # Agente bate em bloco de mensagem: pressiona o pulo e não se move
+            if message:
                 action = 0
+            else:
+                prof.lap(profiler.CONTROL)
+                if inference.client is not None:
+                    act_idx = inference.client.predict(agent_id, state)
+                else:
+                    act_idx = net.act(state)
+                action = actions_list[act_idx]
+                prof.lap(profiler.PREDICT)
 
-            # ram[0x0DDA] = 0xff indica que o agente morreu ou concluiu a fase
-            is_done = agent.is_stoped() or x < dead_line or ram[0x0DDA] == 0xff
+            if agent.is_stoped():
+                reason = END_STOPED
+            elif x < dead_line:
+                reason = END_DEADLINE
+            elif level_over:
+                reason = END_LEVEL
+            else:
+                reason = None
 
-            # ram[0x1493] = 0x00 indica que a animação de término da fase já acabou
-            if is_done and ram[0x1493] == 0x00:
+            if reason is not None and animation_over:
                 break
                 
-            dead_line += dead_line_speed
+            dead_line += DEAD_LINE_SPEED
+
+            # O pulo só é contado se o episódio continua, como no trace
+            if message:
+                frames += frameCount(1)
+            if trace is not None:
+                trace.append(traces.MESSAGE if message else act_idx)
+
+            if not live:
+                edge = node.children.get(action)
+                if edge is not None:
+                    # Ação já jogada a partir deste nó: segue pela árvore
+                    reward, child = edge
+                    path.append(node)
+                    taken.append(action)
+                    node = child
+
+                    points += reward
+                    frames += frameCount(action)
+                    prof.lap(profiler.CONTROL)
+                    continue
+
+                # Primeira ação nova: leva o emulador até este nó e guarda
+                # um savestate nele, que passa a ser um ponto de ramificação
+                prof.lap(profiler.CONTROL)
+                emulated += tree.catchUp(env, path + [node], taken, perform)
+                tree.store(node, env.em.get_state())
+                live = True
 
-            reward, done, info = performAction(action, env)
+            prof.lap(profiler.CONTROL)
+            if message:
+                perform(1, env)
+                emulated += frameCount(1)
+
+            reward, done, info = perform(action, env)
+            prof.lap(profiler.EMULATOR)
+
+            if spectator.streaming(agent_id):
+                spectator.ring.write(env.em.get_screen())
 
             points += reward
+            frames += frameCount(action)
+            emulated += frameCount(action)
 
             if(render):
                 env.render()
+                prof.lap(profiler.RENDER)
 
     finally:
         env.render(close=True)
-        env.close()
 
-    agent.points = points
-    agent.setScore()
-    return agent
+    prof.lap(profiler.CONTROL)
+    prof.finish(emulated)
+    return Result(float(points), int(agent.max_x), frames, reason, emulated,
+                  bytes(trace) if trace is not None else None, captured or None)
+
+
+
+def recapture(library, evaluator, captured, level):
+    """ Acrescenta à biblioteca de inícios os checkpoints do episódio que
+    foi mais longe entre os 'captured' (max_x, checkpoints, agente). Os
+    episódios devolvem apenas a posição e o frame de cada checkpoint; os
+    savestates são obtidos jogando de novo o episódio vencedor (o genoma
+    continua nos genomas compartilhados) até o frame do último deles.
+    Retorna quantos checkpoints foram acrescentados e os frames emulados
+    """
+    if not captured:
+        return 0, 0
+    max_x, points, i = max(captured, key=lambda c: c[0])
+    last = max(f for x, f, snapshot in points)
+
+    result = evaluator.submit(train_level, agent_id=i, render=False, level=level, budget=last + 1,
+                              capture=library.capture(), savestates=True).result()
+    if isinstance(result, Paused):
+        result = result.result
+    return library.add([(x, snapshot) for x, f, snapshot in result.starts or []]), result.emulated
+
+
+
+def startState(library, i, record):
+    """ Estado inicial de um episódio no checkpoint i da biblioteca de
+    inícios, no formato do argumento 'resume' de train_level: o agente
+    começa parado no checkpoint, com a dead line a DEAD_LINE dele
+    """
+    x = library.xs[i]
+    progress = (x, 0, x, 0, x, STOP_TIME, False)
+    return (library.snapshots[i], progress, x + DEAD_LINE, 0, 0, bytearray() if record else None, None, [])
+
+
+
+def comparable(agents):
+    """ Scores dos agentes na escala dos que começaram no início do level.
+    Os checkpoints são sorteados sem olhar o genoma (StartLibrary.choose),
+    então a distribuição dos scores de cada grupo de início vem da mesma
+    população: o agente de posição q (quantil) no seu grupo recebe o
+    score do quantil q entre os do início do level. Sem agentes do início
+    do level, os scores não são alterados
+    """
+    scores = np.array([a.score for a in agents], dtype=np.float64)
+    starts = np.array([getattr(a, 'start', 0) for a in agents])
+    full = scores[starts == 0]
+    if len(full) == 0:
+        return scores
+
+    comparable = scores.copy()
+    for start in np.unique(starts[starts != 0]):
+        group = np.flatnonzero(starts == start)
+        ranks = np.argsort(np.argsort(scores[group], kind='stable'), kind='stable')
+        comparable[group] = np.quantile(full, (ranks + 0.5) / len(group))
+    return comparable
+
+
+
+def relative(result, start):
+    """ Resultado com a distância contada a partir do checkpoint de início
+    """
+    return result._replace(max_x=result.max_x - start) if start else result
+
+
+
+def saveBest(agent, training_file):
+    """ Salva o melhor agente e, se gravadas, as decisões do seu episódio
+    (em "[agente]_trace.npz", que pode ser reproduzido com play.py --replay)
+    """
+    agent.save(training_file)
+    if getattr(agent, 'trace', None) is not None:
+        traces.save(training_file[:-len(".pkl")] + "_trace.npz", args.level,
+                    agent.trace, agent.points, agent.max_x, agent.frames)
 
 
 
@@ -154,8 +607,34 @@ def repopulate(agents, training_file):
     Quanto maior o fitness do agente, menor é a probabilidade de um link de sua rede neural
     sofrer mutação. 
     """
-    popsize = len(agents)
     agents.sort(reverse=True)
+    children = offspring(agents)
+
+    # Atualiza o best_ever, caso necessário. Apenas agentes avaliados a
+    # partir do início do level (ver starts.py) são comparados
+    full = [a for a in agents if getattr(a, 'start', 0) == 0]
+    curr_best = full[0] if full else agents[0]
+    global best_ever
+    if full and (best_ever is None or curr_best > best_ever):
+        best_ever = curr_best
+        saveBest(curr_best, training_file)
+        print("BEST ONE REPLACED!")
+
+    # Imprime relatório do melhor agenta da geração
+    print("Fitness: {:.3f} | Points: {:4,.0f} | Distance: {:4,.0f}".format(
+        curr_best.fitness, curr_best.points, curr_best.max_x))
+    print("------------------------------------------------")
+
+    return children
+
+
+
+def offspring(agents, alpha=ALPHA, mut_rate=MUT_RATE):
+    """ Filhos da população 'agents' (ordenada do melhor para o pior), que
+    também recebem o fitness. Toda a população é sorteada, copiada e
+    mutada de uma só vez
+    """
+    popsize = len(agents)
 
     # Fitness baseado na pontuação
     fitnesses = list([a.score/max_score for a in agents])
@@ -169,33 +648,227 @@ def repopulate(agents, training_file):
     # Probabilidade de reprodução (soma das probabilidades = 1)
     prob = [c/fitSum for c in fitnesses]
 
-    # Atualiza o best_ever, caso necessário
-    curr_best = agents[0]
+    population = Population.fromAgents(agents)
+    parents = population.select(prob, popsize)
+    children = population.take(parents)
+
+    temperature = 1 - np.array(fitnesses)[parents]
+    stdDev = np.maximum(temperature * alpha, 0.01)
+
+    children.mutation(prob=mut_rate, stdDev=stdDev)
+
+    return [agents[p].copy(children.brain(i)) for i, p in enumerate(parents)]
+
+
+
+def createPool(genomes, processes, render):
+    """ Cria o pool local de avaliação com os initializers definidos pelas
+    flags. Retorna o pool, o servidor de inferência e os totais do
+    profiler (os dois últimos podem ser None)
+    """
+    initializers = [(population.initWorker, genomes.spec())]
+
+    server = None
+    if args.inference:
+        server = InferenceServer(input_size, processes, genomes)
+        initializers.append((inference.initWorker, server.clientArgs()))
+
+    if args.headless and not render:
+        initializers.append((pool.initHeadless, ()))
+
+    if args.snapshots > 0:
+        initializers.append((snapshots.initWorker, (args.snapshots*2**20, SNAPSHOT_NODES)))
+
+    profile = None
+    if args.profile or args.pstats is not None:
+        profile = profiler.sharedTotals()
+        if args.pstats is not None:
+            os.makedirs(args.pstats, exist_ok=True)
+        initializers.append((profiler.initWorker, (profile, args.pstats)))
+
+    if spectator.ring is not None:
+        initializers.append((spectator.initWorker, (spectator.ring.name,)))
+
+    try:
+        return EvaluationPool(processes, initializers), server, profile
+    except BaseException:
+        if server is not None:
+            server.close()
+        raise
+
+
+
+def work(address, processes, render):
+    """ Modo worker: avalia os episódios enviados pelo coordenador em
+    'address' até ele encerrar o treinamento (ver remote.py)
+    """
+    genomes = SharedPopulation(topology, processes * remote.PREFETCH)
+    evaluator = server = None
+    try:
+        evaluator, server, profile = createPool(genomes, processes, render)
+        print("Worker: conectando a {}:{} com {} processos".format(*address, processes))
+        jobs = remote.runWorker(address, args.authkey.encode(), genomes, evaluator, train_level,
+                                profile=profile, render=render)
+        print("Worker: {} episódios avaliados | encerramento {:.3f}s".format(jobs, evaluator.close()))
+    finally:
+        if evaluator is not None:
+            evaluator.kill()
+        if server is not None:
+            server.close()
+        genomes.close(unlink=True)
+
+
+
+def train_steady(agents, generation, generations, evaluator, genomes, render, level, training_file,
+                 inflight, cache=None, writer=None, report=None, log=None):
+    """ Evolução em regime permanente (steady state), sem a barreira entre
+    gerações: 'inflight' episódios são avaliados ao mesmo tempo e, assim que
+    um termina, o agente entra na população (no lugar do pior, se não for
+    pior que ele) e um novo filho, sorteado da população atual, é enviado.
+    Os agentes iniciais são avaliados primeiro. A cada len(agents)
+    avaliações (uma "geração") é impresso um relatório e 'report' é
+    chamada com o tempo decorrido (e 'log' com as métricas da geração, ver
+    logMetrics em main). O best_ever é salvo assim que superado.
+    Retorna a população
+    """
     global best_ever
-    if best_ever is None or curr_best > best_ever:
-        best_ever = curr_best
-        curr_best.save(training_file)
-        print("BEST ONE REPLACED!")
-    
-    children = []
+    popsize = len(agents)
+    settings = evalSettings(level)
 
-    for i in range(popsize):
-        p = np.random.choice(agents, p=prob).copy()
-        children.append(p)
+    initial = list(reversed(agents))
+    evaluated = []
+    slots = list(range(len(genomes)))
+    futures = {} # future -> (agente, slot, chave do cache)
 
-    for child in children:
+    def breed():
+        """ Filho de um agente da população sorteado proporcionalmente ao
+        fitness, com mutação como em repopulate
+        """
+        fitnesses = np.array([a.score/max_score for a in evaluated])
+        for a, f in zip(evaluated, fitnesses):
+            a.fitness = f
+        parent = evaluated[np.random.choice(len(evaluated), p=fitnesses/fitnesses.sum())]
+        child = parent.copy()
+        child.mutate(MUT_RATE, stdDev=max((1 - parent.fitness) * ALPHA, 0.01))
+        return child
 
-        temperature = 1 - child.fitness
-        stdDev = max(temperature * ALPHA, 0.01)
+    def insert(agent):
+        global best_ever
+        if len(evaluated) < popsize:
+            evaluated.append(agent)
+        else:
+            worst = min(range(popsize), key=lambda i: evaluated[i].score)
+            if agent.score >= evaluated[worst].score:
+                evaluated[worst] = agent
 
-        child.mutate(prob=MUT_RATE, stdDev=stdDev)
+        if best_ever is None or agent > best_ever:
+            best_ever = agent
+            saveBest(agent, training_file)
+            agent.fitness = agent.score/max_score
+            tqdm.write("BEST ONE REPLACED! Fitness: {:.3f} | Points: {:4,.0f} | Distance: {:4,.0f}".format(
+                agent.fitness, agent.points, agent.max_x))
 
-    # Imprime relatório do melhor agenta da geração
-    print("Fitness: {:.3f} | Points: {:4,.0f} | Distance: {:4,.0f}".format(
-        curr_best.fitness, curr_best.points, curr_best.max_x))
-    print("------------------------------------------------")
+    def submit():
+        """ Envia o próximo agente (inicial ou filho) para avaliação. Agentes
+        no cache entram direto na população. Retorna False se não há o que
+        enviar (fim do treinamento, ou nenhum agente avaliado para cruzar)
+        """
+        nonlocal budget
+        while budget > 0 and (initial or evaluated):
+            budget -= 1
+            agent = initial.pop() if initial else breed()
+            key = None
+            if cache is not None:
+                key = FitnessCache.key(np.concatenate([w.ravel() for w in agent.brain.weights]), settings)
+                result = cache.get(key, args.traces)
+                if result is not None:
+                    agent.setResult(result)
+                    insert(agent)
+                    count(result)
+                    continue
 
-    return children
+            slot = slots.pop()
+            genomes.store(slot, agent)
+
+            # Espectador: ao fim do episódio transmitido, passa ao próximo
+            # agente enviado (com 'best', apenas a um filho do melhor agente)
+            if spectator.ring is not None and spectator.ring.header[spectator.TARGET] < 0:
+                if args.spectate == 'random' or not evaluated or agent.score >= max(evaluated).score:
+                    spectator.ring.watch(slot)
+            future = evaluator.submit(train_level, agent_id=slot, render=render, level=level,
+                                      record=args.traces)
+            futures[future] = (agent, slot, key)
+            return True
+        return False
+
+    budget = (generations - generation) * popsize
+    completed = 0
+    frames = emulated = 0
+    reasons = [0, 0, 0, 0]
+    start = time.perf_counter()
+    pbar = tqdm(total=popsize, colour="green")
+
+    last_best = best_ever
+
+    def count(result):
+        nonlocal completed, frames, emulated, start, pbar, generation, last_best
+        completed += 1
+        frames += result.frames
+        emulated += result.emulated
+        reasons[result.reason] += 1
+        pbar.update(1)
+        if completed % popsize > 0:
+            return
+
+        # Fim de uma "geração": relatório e checkpoint da população
+        pbar.close()
+        elapsed = time.perf_counter() - start
+        best = max(evaluated)
+        best.fitness = best.score/max_score
+        print("Generation: {0:} (steady state)".format(generation))
+        print("Frames: {:,} emulados de {:,} ({:.1%}), {:,.0f} frames/s | Término: parado {} | dead line {} | morte/fim da fase {} | corrida {}".format(
+            emulated, frames, emulated/max(frames, 1), emulated/elapsed, *reasons))
+        costs = report(elapsed) if report is not None else None
+        print("Fitness: {:.3f} | Points: {:4,.0f} | Distance: {:4,.0f}".format(
+            best.fitness, best.points, best.max_x))
+        print("------------------------------------------------")
+        if log is not None:
+            log(generation, evaluated, time.perf_counter() - start, frames, emulated, costs, best_ever is not last_best)
+            last_best = best_ever
+
+        generation += 1
+        if writer is not None and generation % args.checkpoint == 0:
+            writer.submit(checkpoint.capture(evaluated, generation, best_ever))
+
+        frames = emulated = 0
+        reasons[:] = [0, 0, 0, 0]
+        start = time.perf_counter()
+        pbar = tqdm(total=popsize, colour="green")
+
+    def fill():
+        while len(futures) < inflight and slots and submit():
+            pass
+
+    fill()
+    while futures:
+        future = next(as_completed(futures))
+        agent, slot, key = futures.pop(future)
+        slots.append(slot)
+        if spectator.ring is not None and spectator.ring.header[spectator.TARGET] == slot:
+            spectator.ring.watch(-1)
+
+        result = future.result()
+        if cache is not None:
+            cache.put(key, result)
+        agent.setResult(result)
+        insert(agent)
+        count(result)
+        fill()
+
+    pbar.close()
+    if cache is not None:
+        cache.save()
+    return evaluated
 
 
 
@@ -204,21 +877,199 @@ def main():
     generations = args.generations if args.generations != 0 else float('inf')
     popsize     = args.popsize
     processes   = min(os.cpu_count() - 2, args.numproc)
-    render      = not args.hide
+    render      = not args.hide and args.spectate is None
     level       = args.level
+
+    # As mensagens entre coordenador e workers são objetos do pickle: quem
+    # tiver a chave pode executar código do outro lado. Não há chave padrão
+    if args.worker is not None:
+        if args.authkey is None:
+            sys.exit("Worker: informe a chave do coordenador com --authkey")
+        return work(remote.parseAddress(args.worker), processes, render)
+
     training_file = "agents/"+args.agent+".pkl"
-    
-    agents = populate(training_file, topology, popsize)
+    checkpoint_file = "agents/"+args.agent+"_checkpoint.npz"
+    schedule_log = "agents/"+args.agent+"_schedule.csv" if args.schedule_log else None
+    starts_file = "agents/"+args.agent+"_starts.npz"
 
-    generation = agents[0].generation
+    # Biblioteca de inícios no meio do level (recomeça com -s)
+    library = None
+    if args.starts > 0:
+        library = StartLibrary(level, args.starts)
+        if not args.startover:
+            library = StartLibrary.load(starts_file, level, args.starts)
+    
+    # O checkpoint só é retomado com --resume
+    if args.resume and not args.startover and os.path.isfile(checkpoint_file):
+        agents, generation = resume(checkpoint_file, popsize)
+    else:
+        if args.resume and not args.startover:
+            print("Checkpoint: '{}' não encontrado, o treinamento começa de '{}'".format(checkpoint_file, training_file))
+        elif not args.startover and os.path.isfile(checkpoint_file):
+            print("Checkpoint: '{}' não retomado (use --resume), o treinamento começa de '{}'".format(
+                checkpoint_file, training_file))
+        agents = populate(training_file, topology, popsize)
+        generation = agents[0].generation
     generations += generation
 
-    # loop principal. Para interromper: CTRL + C
-    while generation < generations:
-        eval = train(agents, generation, processes, render, level)
-        agents = repopulate(eval, training_file)
-        generation += 1
+    # Pesos da população, compartilhados com os workers. Os recursos
+    # criados em seguida ficam dentro do try, para que o bloco seja
+    # liberado mesmo se a criação do pool falhar
+    genomes = SharedPopulation(topology, max(popsize, args.steady))
+    viewer = evaluator = server = profile = writer = log = None
+
+    def report(elapsed):
+        """ Relatórios do pool e dos workers ao fim de cada geração.
+        Retorna os custos do pool
+        """
+        costs = evaluator.report()
+        printCosts(costs)
+        if args.listen > 0:
+            printRemote(evaluator.summary())
+        else:
+            printUtilization(costs, processes, elapsed)
+        if profile is not None:
+            print(profiler.report(profiler.collect(profile)))
+        elif args.listen > 0 and args.profile:
+            # os tempos dos episódios chegam com os resultados dos workers
+            totals = evaluator.collectProfile()
+            print(profiler.report(totals) if totals is not None else
+                  "Perfil: nenhum worker enviou os tempos (use --profile nos workers)")
+        if server is not None:
+            requests, batches = server.report()
+            print("Inferência: {:,} decisões em {:,} lotes ({:.2f} por lote)".format(
+                requests, batches, requests/max(batches, 1)))
+        return costs
 
+    def logMetrics(generation, agents, seconds, frames, emulated, costs, changed):
+        """ Acrescenta a linha da geração ao log de métricas. O tempo
+        ocioso dos workers só é conhecido com o pool local. A distância
+        do melhor agente é contada do início do level, mesmo que ele
+        tenha começado em um checkpoint (ver starts.py)
+        """
+        scores = np.array([a.score for a in agents])
+        best = max(agents)
+        q = np.percentile(scores, [0, 25, 50, 75, 100])
+        busy = costs['tempo ocupado'] if costs is not None else None
+        idle = utilization = None
+        if busy is not None and args.listen == 0:
+            idle = max(processes*seconds - busy, 0.0)
+            utilization = busy / max(processes*seconds, 1e-9)
+        log.write(generation=generation, seconds=seconds, episodes=len(agents), frames=frames,
+                  emulated=emulated, frames_per_s=emulated/max(seconds, 1e-9),
+                  episodes_per_s=len(agents)/max(seconds, 1e-9), busy=busy, idle=idle,
+                  utilization=utilization, score_min=q[0], score_q25=q[1], score_median=q[2],
+                  score_q75=q[3], score_max=q[4], score_mean=scores.mean(),
+                  best_distance=getattr(best, 'start', 0) + best.max_x, best_ever=best_ever.score if best_ever is not None else None,
+                  best_ever_changed=changed)
+
+    try:
+        # Espectador: um processo exibe a tela transmitida por um dos workers
+        # locais (workers remotos não transmitem)
+        if args.spectate is not None and args.listen == 0:
+            spectator.ring = SpectatorRing()
+            viewer = mp.Process(target=spectator.view, args=(spectator.ring.name,), daemon=True)
+            viewer.start()
+
+        # Coordenador: os episódios são avaliados por workers remotos
+        if args.listen > 0:
+            authkey = args.authkey
+            if authkey is None:
+                authkey = secrets.token_hex(16)
+                print("Coordenador: chave gerada para os workers: --authkey {}".format(authkey))
+            evaluator = RemotePool((args.host, args.listen), authkey.encode(), genomes)
+            server = profile = None
+            print("Coordenador: aguardando workers em {}:{}".format(args.host, args.listen))
+        else:
+            evaluator, server, profile = createPool(genomes, processes, render)
+
+        cache = None
+        if args.cache > 0:
+            cache_file = "agents/"+args.agent+"_cache.npz" if args.disk_cache else None
+            cache = FitnessCache(args.cache, cache_file)
+
+        # Checkpoints salvos em segundo plano, sem interromper a avaliação
+        writer = CheckpointWriter(checkpoint_file) if args.checkpoint > 0 else None
+
+        # Métricas de cada geração, acrescentadas a "[agente]_metrics.csv"
+        log = MetricsLog("agents/"+args.agent+"_metrics.csv")
+
+        # loop principal. Para interromper: CTRL + C
+        if args.steady > 0:
+            train_steady(agents, generation, generations, evaluator, genomes, render, level,
+                         training_file, args.steady, cache, writer, report, logMetrics)
+            generation = generations
+
+        while generation < generations:
+            start = time.perf_counter()
+            size = len(library) if library is not None else 0
+            stats = {}
+            eval = train(agents, generation, evaluator, genomes, render, level, cache,
+                         args.race if args.race > 0 else None, schedule_log, library, stats)
+            costs = report(time.perf_counter() - start)
+            if library is not None and len(library) > size:
+                library.save(starts_file)
+            last_best = best_ever
+            agents = repopulate(eval, training_file)
+            logMetrics(generation, eval, time.perf_counter() - start, stats['frames'], stats['emulated'],
+                       costs, best_ever is not last_best)
+            generation += 1
+
+            if writer is not None and generation % args.checkpoint == 0:
+                writer.submit(checkpoint.capture(agents, generation, best_ever))
+
+        print("Pool: início {:.3f}s | encerramento {:.3f}s".format(
+            evaluator.startup, evaluator.close()))
+    finally:
+        if evaluator is not None:
+            evaluator.kill()
+        if writer is not None:
+            # um erro ao salvar o último checkpoint não esconde a exceção
+            # que interrompeu o treinamento
+            try:
+                writer.close()
+                print("Checkpoints: {} salvos ({:.3f}s em segundo plano)".format(writer.written, writer.seconds))
+            except Exception as e:
+                print("Checkpoints: {} salvos | erro ao salvar '{}': {}".format(writer.written, checkpoint_file, e))
+        if server is not None:
+            server.close()
+        if viewer is not None:
+            print("Espectador: {:,} frames transmitidos, {:,} exibidos".format(
+                spectator.ring.header[spectator.WRITTEN], spectator.ring.header[spectator.SHOWN]))
+            viewer.terminate()
+        if spectator.ring is not None:
+            spectator.ring.close(unlink=True)
+        genomes.close(unlink=True)
+        if log is not None:
+            log.close()
+
+
+def printRemote(stats):
+    """ Imprime o envio de jobs aos workers remotos na geração
+    """
+    print("Workers: {} conectados | {} jobs em {} lotes ({:.1f} por lote) | {} perdidos | {} jobs reenviados".format(
+        stats['workers'], stats['jobs'], stats['lotes'], stats['jobs']/max(stats['lotes'], 1),
+        stats['perdidos'], stats['reenviados']))
+
+
+
+def printUtilization(costs, processes, elapsed):
+    """ Imprime a fração do tempo em que os workers estiveram ocupados
+    com episódios na geração. O tempo de cada episódio é contado quando ele
+    termina (no steady state, um episódio pode começar na geração anterior)
+    """
+    print("Utilização dos workers: {:.1%} ({:.1f}s ocupados de {} x {:.1f}s)".format(
+        costs['tempo ocupado']/max(processes*elapsed, 1e-9), costs['tempo ocupado'], processes, elapsed))
+
+
+
+def printCosts(costs):
+    """ Imprime os custos de criação e reset de emuladores da geração
+    """
+    episodes = max(costs['episódios'], 1)
+    print("Emuladores criados: {:.0f} ({:.2f}s) | Episódios: {:.0f} (reset médio {:.1f}ms)".format(
+        costs['emuladores'], costs['tempo de criação'],
+        costs['episódios'], 1000*costs['tempo de reset']/episodes))
 
 
 
@@ -46,22 +46,41 @@ def printState(state, radius):
     print(out)
 
 
+def frameCount(a):
+    """ Número de frames em que a ação 'a' é mantida
+    """
+    if a in long_actions:
+        return 8
+    elif a in short_actions:
+        return 4
+    return 1
+
+
 def performAction(a, env):
     reward = 0
     bin_a = dec2bin(a)
-    if a in long_actions:
-        for it in range(8):
-            ob, rew, done, info = env.step(bin_a)
-            reward += rew
-    elif a in short_actions:
-        for it in range(4):
-            ob, rew, done, info = env.step(bin_a)
-            reward += rew
-    else:
+    for it in range(frameCount(a)):
         ob, rew, done, info = env.step(bin_a)
         reward += rew
     return reward, done, info
 
 
+def performActionFast(a, env):
+    """ Mesmo efeito de performAction, mas acionando o emulador diretamente:
+    a ação é convertida uma única vez e nenhuma observação (imagem ou RAM)
+    nem dicionário 'info' é criado a cada frame. A imagem usada por
+    env.render() não é atualizada
+    """
+    for p, ap in enumerate(env.action_to_array(dec2bin(a))):
+        env.em.set_button_mask(ap, p)
+
+    reward = 0
+    for it in range(frameCount(a)):
+        env.em.step()
+        env.data.update_ram()
+        reward += env.data.current_reward()
+    return reward, env.data.is_done(), {}
+
+
 def scaling(value, old_min, old_max, new_min, new_max):
   return ((value - old_min)/(old_max - old_min))*(new_max-new_min) + new_min
\ No newline at end of file